@@ -0,0 +1,436 @@
+from enigma import (alphabet, state_count, scramble_array,
+                    create_plugboard_dict, Enigma, _require_closed_form)
+from bombe import plugboard_from_steckers
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import permutations
+import math
+import os
+import random
+import numpy
+
+# Number of starting positions decrypted at once by the search kernel:
+block_size = 2048
+
+
+def letter_indexes(text: str) -> object:
+    '''Converts letters of a text to numpy array of letter indexes,
+    whitespace is skipped'''
+
+    letters = ''.join(text.split()).upper().encode('ascii')
+    indexes = numpy.frombuffer(letters, dtype=numpy.uint8).astype(numpy.intp)
+    if len(indexes) and (indexes.min() < 65 or indexes.max() > 90):
+        raise ValueError('Text must consist of letters only')
+    return indexes - 65
+
+
+def index_of_coincidence(indexes: object) -> object:
+    '''Returns the index of coincidence of every row of a 2D array of
+    letter indexes (or of a single 1D array)'''
+
+    indexes = numpy.atleast_2d(indexes)
+    rows, length = indexes.shape
+    offsets = numpy.arange(rows)[:, None] * 26
+    counts = numpy.bincount((indexes + offsets).ravel(),
+                            minlength=rows * 26).reshape(rows, 26)
+    coincidences = (counts * (counts - 1)).sum(axis=1)
+    return coincidences / max(length * (length - 1), 1)
+
+
+def ngram_table(text: str, n: int = 2) -> object:
+    '''Creates a table of log probabilities of n letter sequences of
+    a sample text, indexed by n-gram number (letter indexes in base 26).
+    Unseen n-grams get a probability of a hundredth of a single one'''
+
+    indexes = letter_indexes(text)
+    numbers = _ngram_numbers(indexes[None, :], n)[0]
+    counts = numpy.bincount(numbers, minlength=26 ** n).astype(float)
+    counts[counts == 0] = 0.01
+    return numpy.log(counts / counts.sum())
+
+
+def _ngram_numbers(indexes: object, n: int) -> object:
+    '''Returns n-gram numbers of every row of a 2D array of indexes'''
+
+    length = indexes.shape[1] - n + 1
+    numbers = numpy.zeros((indexes.shape[0], max(length, 0)),
+                          dtype=numpy.intp)
+    for shift in range(n):
+        numbers = numbers * 26 + indexes[:, shift:shift + length]
+    return numbers
+
+
+def ngram_score(indexes: object, table: object) -> object:
+    '''Returns the sum of n-gram log probabilities of every row of
+    a 2D array of letter indexes (or of a single 1D array)'''
+
+    n = round(math.log(len(table), 26))
+    return table[_ngram_numbers(numpy.atleast_2d(indexes), n)].sum(axis=1)
+
+
+def trial_decrypt(rotors: str, reflector_type: str, ring_setting: str,
+                  starts: object, indexes: object) -> object:
+    '''Decrypts letter indexes of a ciphertext without plugboard from
+    every starting position given as packed rotor states.
+    Returns a starting positions x letters array of letter indexes'''
+
+    starts = numpy.asarray(starts)
+    positions = numpy.stack(
+        (starts // 676, starts // 26 % 26, starts % 26), axis=1)
+    rings = numpy.tile([alphabet.index(letter) for letter in ring_setting],
+                       (len(starts), 1))
+    message = numpy.broadcast_to(indexes, (len(starts), len(indexes)))
+    return scramble_array(rotors, reflector_type, positions, rings, message)
+
+
+def _position_string(state: int) -> str:
+    '''Converts a packed rotor state to position letters'''
+
+    left, state = divmod(int(state), 676)
+    middle, right = divmod(state, 26)
+    return alphabet[left] + alphabet[middle] + alphabet[right]
+
+
+def _search_positions(rotors: str, reflector_type: str, indexes: object,
+                      candidates: int) -> list:
+    '''Process pool worker, scores every starting position of one rotor
+    order (ring setting AAA) by index of coincidence.
+    Returns the best (score, rotors, position) candidates'''
+
+    scores = numpy.empty(state_count)
+    for start in range(0, state_count, block_size):
+        starts = numpy.arange(start, min(start + block_size, state_count))
+        decrypted = trial_decrypt(rotors, reflector_type, 'AAA',
+                                  starts, indexes)
+        scores[starts] = index_of_coincidence(decrypted)
+
+    best = numpy.argsort(scores)[::-1][:candidates]
+    return [(float(scores[state]), rotors, _position_string(state))
+            for state in best]
+
+
+def _climb_rings(rotors: str, reflector_type: str, position: str,
+                 indexes: object, table: object) -> tuple:
+    '''Hill climbs ring settings of the right and middle rotor, moving the
+    starting position together with the ring so the wiring stays aligned.
+    Scores with n-gram table, or index of coincidence if table is None.
+    Returns the best (score, ring setting, position)'''
+
+    def score(decrypted):
+        if table is None:
+            return index_of_coincidence(decrypted)
+        return ngram_score(decrypted, table)
+
+    rings = [0, 0, 0]
+    starts = [alphabet.index(letter) for letter in position]
+    best_score = score(trial_decrypt(
+        rotors, reflector_type, 'AAA', [_pack(starts)], indexes))[0]
+
+    improved = True
+    while improved:
+        improved = False
+        for number in (2, 1):
+            trial_rings = []
+            trial_starts = []
+            for shift in range(26):
+                ring = list(rings)
+                start = list(starts)
+                ring[number] = (ring[number] + shift) % 26
+                start[number] = (start[number] + shift) % 26
+                trial_rings.append(ring)
+                trial_starts.append(start)
+            decrypted = scramble_array(
+                rotors, reflector_type, numpy.array(trial_starts),
+                numpy.array(trial_rings),
+                numpy.broadcast_to(indexes, (26, len(indexes))))
+            scores = score(decrypted)
+            shift = int(numpy.argmax(scores))
+            if scores[shift] > best_score:
+                best_score = scores[shift]
+                rings, starts = trial_rings[shift], trial_starts[shift]
+                improved = True
+
+    return (float(best_score), ''.join(alphabet[ring] for ring in rings),
+            ''.join(alphabet[start] for start in starts))
+
+
+def _pack(positions: list) -> int:
+    '''Packs three position indexes into a rotor state number'''
+    return positions[0] * 676 + positions[1] * 26 + positions[2]
+
+
+def ciphertext_only_search(ciphertext: str, reflector_type: str = 'B',
+                           rotor_orders: list = None, candidates: int = 10,
+                           threshold: float = None, ngrams: object = None,
+                           workers: int = None) -> list:
+    '''Searches rotor order and starting position of a ciphertext by
+    index of coincidence of trial decryptions without plugboard, then
+    hill climbs ring settings of the best candidates, scored with ngrams
+    table (see ngram_table) or index of coincidence.
+    Rotor orders (default all 60) are split between worker processes,
+    the search stops early once a candidate reaches threshold.
+    Returns settings dictionaries (keys as written by
+    save_settings_to_json) with a score, best first'''
+
+    indexes = letter_indexes(ciphertext)
+    reflector_type = reflector_type.upper()
+    rotor_orders = rotor_orders or [
+        ''.join(order) for order in permutations('12345', 3)
+    ]
+    for rotors in rotor_orders:
+        _require_closed_form(rotors)
+
+    found = []
+    with ProcessPoolExecutor(workers or os.cpu_count()) as executor:
+        futures = [
+            executor.submit(_search_positions, rotors, reflector_type,
+                            indexes, candidates)
+            for rotors in rotor_orders
+        ]
+        for future in as_completed(futures):
+            found.extend(future.result())
+            if threshold is not None and \
+                    max(score for score, _, _ in found) >= threshold:
+                for other in futures:
+                    other.cancel()
+                break
+
+    found.sort(reverse=True)
+    results = []
+    for _, rotors, position in found[:candidates]:
+        score, ring_setting, position = _climb_rings(
+            rotors, reflector_type, position, indexes, ngrams)
+        results.append({
+            'rotors': rotors,
+            'ring_setting': ring_setting,
+            'position': position,
+            'reflector': reflector_type,
+            'plugboard': '',
+            'score': score
+        })
+    results.sort(key=lambda settings: settings['score'], reverse=True)
+    return results
+
+
+class PlugboardSearch:
+    '''Plugboard search for fixed rotor settings, scores plaintext with
+    an n-gram table. The plugboard-free scrambler output of every position
+    is cached, so a plugboard change is scored by updating only positions
+    involving changed letters and n-grams overlapping them.
+        settings:   dictionary with keys as written by save_settings_to_json,
+                    plugboard is ignored
+        ciphertext: letters, whitespace is skipped
+        table:      n-gram log probabilities, see ngram_table
+    '''
+    def __init__(self, settings: dict, ciphertext: str, table: object):
+
+        cipher = letter_indexes(ciphertext)
+        length = len(cipher)
+
+        # Scrambler output of every letter at every position, encrypted
+        # by a machine without plugboard, so any rotors (thin, two notch)
+        # step as in Enigma:
+        machine = Enigma(settings['rotors'], settings['ring_setting'],
+                         settings['position'], settings['reflector'].upper())
+        scrambled = numpy.array([
+            machine.clone().encrypt_array(
+                numpy.full(length, 65 + letter, dtype=numpy.uint8))
+            for letter in range(26)
+        ], dtype=numpy.intp).reshape(26, length) - 65
+
+        self._n = round(math.log(len(table), 26))
+        self._table = numpy.asarray(table).tolist()
+        self._scrambler = scrambled.T.tolist()
+        self._cipher = cipher.tolist()
+        self._steckers = list(range(26))
+        self._pairs = 0
+
+        # Letters between plugboard passes and positions indexed by them:
+        self._middle = [
+            self._scrambler[position][letter]
+            for position, letter in enumerate(self._cipher)
+        ]
+        self._plain = list(self._middle)
+        self._by_cipher = [set() for _ in range(26)]
+        self._by_middle = [set() for _ in range(26)]
+        for position, letter in enumerate(self._cipher):
+            self._by_cipher[letter].add(position)
+            self._by_middle[self._middle[position]].add(position)
+
+        self._score = sum(
+            self._table[self._ngram(start)]
+            for start in range(length - self._n + 1)
+        )
+
+    def _ngram(self, start: int, patch: dict = None) -> int:
+        '''Private, returns the plaintext n-gram number starting at
+        position, with plain letters of positions in patch replaced'''
+
+        number = 0
+        for position in range(start, start + self._n):
+            letter = self._plain[position]
+            if patch:
+                letter = patch.get(position, letter)
+            number = number * 26 + letter
+        return number
+
+    def _changes(self, first: int, second: int) -> dict:
+        '''Private, returns new partners of letters affected by swapping
+        connection of given letters: connects them, or disconnects them
+        if already connected to each other'''
+
+        if self._steckers[first] == second:
+            return {first: first, second: second}
+
+        changes = {}
+        for letter in (first, second):
+            changes[self._steckers[letter]] = self._steckers[letter]
+        changes[first] = second
+        changes[second] = first
+        return changes
+
+    def _evaluate(self, changes: dict) -> tuple:
+        '''Private, returns score difference of a plugboard change, new
+        middle and plain letters of affected positions'''
+
+        positions = set()
+        for letter in changes:
+            positions |= self._by_cipher[letter]
+            positions |= self._by_middle[letter]
+
+        steckers = self._steckers
+        middle = {}
+        plain = {}
+        for position in positions:
+            letter = self._cipher[position]
+            letter = self._scrambler[position][changes.get(letter,
+                                                           steckers[letter])]
+            middle[position] = letter
+            plain[position] = changes.get(letter, steckers[letter])
+
+        last_start = len(self._cipher) - self._n
+        starts = set()
+        for position in positions:
+            starts.update(range(max(0, position - self._n + 1),
+                                min(position, last_start) + 1))
+
+        delta = sum(
+            self._table[self._ngram(start, plain)] -
+            self._table[self._ngram(start)]
+            for start in starts
+        )
+        return delta, middle, plain
+
+    def _pairs_after(self, changes: dict) -> int:
+        '''Private, number of connected pairs after a plugboard change'''
+
+        before = sum(1 for letter in changes
+                     if self._steckers[letter] > letter)
+        after = sum(1 for letter, partner in changes.items()
+                    if partner > letter)
+        return self._pairs - before + after
+
+    def score_swap(self, first: str, second: str) -> float:
+        '''Returns the score difference of swapping connection of two
+        letters, without changing the plugboard'''
+
+        first, second = alphabet.index(first), alphabet.index(second)
+        return self._evaluate(self._changes(first, second))[0]
+
+    def swap(self, first: str, second: str) -> float:
+        '''Connects two letters, disconnecting their previous partners,
+        or disconnects them if connected to each other.
+        Returns the score difference'''
+
+        first, second = alphabet.index(first), alphabet.index(second)
+        return self._apply(self._changes(first, second))
+
+    def _apply(self, changes: dict, evaluated: tuple = None) -> float:
+        '''Private, applies a plugboard change and updates cached letters'''
+
+        delta, middle, plain = evaluated or self._evaluate(changes)
+        self._pairs = self._pairs_after(changes)
+        for letter, partner in changes.items():
+            self._steckers[letter] = partner
+        for position, letter in middle.items():
+            self._by_middle[self._middle[position]].discard(position)
+            self._by_middle[letter].add(position)
+            self._middle[position] = letter
+        for position, letter in plain.items():
+            self._plain[position] = letter
+        self._score += delta
+        return delta
+
+    def hill_climb(self, max_pairs: int = 10) -> str:
+        '''Applies the best improving swap of all letter pairs until no
+        swap improves the score. Returns the plugboard string'''
+
+        improved = True
+        while improved:
+            improved = False
+            best = None
+            for first in range(26):
+                for second in range(first + 1, 26):
+                    changes = self._changes(first, second)
+                    if self._pairs_after(changes) > max_pairs:
+                        continue
+                    evaluated = self._evaluate(changes)
+                    if evaluated[0] > 1e-9 and \
+                            (best is None or evaluated[0] > best[1][0]):
+                        best = (changes, evaluated)
+            if best:
+                self._apply(*best)
+                improved = True
+        return self.plugboard()
+
+    def anneal(self, steps: int = 20000, temperature: float = 10.0,
+               cooling: float = 0.9995, max_pairs: int = 10,
+               seed: int = None) -> str:
+        '''Simulated annealing over random swaps, a worse swap is accepted
+        with probability exp(delta / temperature). Leaves the best found
+        plugboard set and returns it as plugboard string'''
+
+        generator = random.Random(seed)
+        best_score = self._score
+        best_steckers = list(self._steckers)
+
+        for _ in range(steps):
+            first, second = generator.sample(range(26), 2)
+            changes = self._changes(first, second)
+            if self._pairs_after(changes) > max_pairs:
+                continue
+            evaluated = self._evaluate(changes)
+            delta = evaluated[0]
+            if delta > 0 or \
+                    generator.random() < math.exp(delta / temperature):
+                self._apply(changes, evaluated)
+                if self._score > best_score:
+                    best_score = self._score
+                    best_steckers = list(self._steckers)
+            temperature *= cooling
+
+        self.set_plugboard(plugboard_from_steckers(best_steckers))
+        return self.plugboard()
+
+    def set_plugboard(self, pairs: str) -> None:
+        '''Sets plugboard from string of letter pairs divided by spaces'''
+
+        for letter in range(26):
+            if self._steckers[letter] > letter:
+                self._apply(self._changes(letter, self._steckers[letter]))
+        for pair in create_plugboard_dict(pairs).items():
+            if pair[0] < pair[1]:
+                self.swap(*pair)
+
+    # Getters:
+
+    def score(self) -> float:
+        '''Returns the n-gram score of current decryption'''
+        return self._score
+
+    def plugboard(self) -> str:
+        '''Returns current plugboard as a string of letter pairs'''
+        return plugboard_from_steckers(self._steckers)
+
+    def plaintext(self) -> str:
+        '''Returns the decryption with current plugboard'''
+        return ''.join(alphabet[letter] for letter in self._plain)
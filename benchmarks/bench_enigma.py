@@ -0,0 +1,171 @@
+'''Benchmarks of encryption hot paths.
+
+Run from the repository root:
+    python -m benchmarks.bench_enigma -output results.json
+    python -m benchmarks.bench_enigma -compare results.json
+'''
+from enigma import shift_char, caesar_shift, Rotor, Enigma
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+# Message sizes of Enigma.encrypt benchmarks, 10 characters to 100 MB:
+default_sizes = [10, 1000, 100000, 10 ** 7, 10 ** 8]
+
+# Maps every byte value to a capital letter:
+letter_table = bytes(65 + value % 26 for value in range(256))
+
+
+def random_message(size: int, seed: int) -> str:
+    '''Returns a reproducible random message of capital letters'''
+
+    generator = random.Random(seed)
+    return generator.randbytes(size).translate(letter_table).decode('ascii')
+
+
+def measure(function: object, number: int, repeat: int = 5) -> float:
+    '''Returns the best time of a single call of function in seconds'''
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def peak_memory(function: object) -> int:
+    '''Returns peak memory allocated during a call of function in bytes'''
+
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def result(seconds: float, units: int = 1, memory: int = None) -> dict:
+    '''Creates a benchmark result, units are items processed per call'''
+
+    entry = {
+        'latency_ns': seconds * 1e9,
+        'ops_per_second': units / seconds if seconds else 0.0
+    }
+    if memory is not None:
+        entry['peak_memory_bytes'] = memory
+    return entry
+
+
+def micro_benchmarks(seed: int) -> dict:
+    '''Benchmarks single operations of helper functions, Rotor and Enigma'''
+
+    generator = random.Random(seed)
+    letter = generator.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+    text = random_message(26, seed)
+    rotor = Rotor('1', 'K', 'F')
+    enigma = Enigma('312', 'BCD', 'XYZ', 'B', 'AB CD EF')
+
+    benchmarks = {
+        'shift_char': lambda: shift_char(letter, 3),
+        'caesar_shift_26': lambda: caesar_shift(text, 3),
+        'Rotor.turn': rotor.turn,
+        'Rotor.liro': lambda: rotor.liro(letter),
+        'Rotor.rilo': lambda: rotor.rilo(letter),
+        'Enigma.__init__': lambda: Enigma('312', 'BCD', 'XYZ', 'B',
+                                          'AB CD EF'),
+        'Enigma.encrypt_char': lambda: enigma.encrypt_char(letter),
+    }
+    return {
+        name: result(measure(function, 1000))
+        for name, function in benchmarks.items()
+    }
+
+
+def encrypt_benchmarks(sizes: list, seed: int, memory: bool) -> dict:
+    '''Benchmarks Enigma.encrypt throughput (chars/sec) on messages
+    of given sizes, and optionally its peak memory use'''
+
+    results = {}
+    enigma = Enigma('312', 'BCD', 'XYZ', 'B', 'AB CD EF')
+    for size in sizes:
+        message = random_message(size, seed)
+
+        def encrypt():
+            enigma.encrypt(message)
+
+        number = max(1, 10000 // size)
+        repeat = 5 if size <= 10 ** 6 else 1
+        seconds = measure(encrypt, number, repeat)
+        used_memory = peak_memory(encrypt) if memory else None
+        results[f'Enigma.encrypt_{size}'] = result(seconds, size, used_memory)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    '''Returns names of benchmarks slower than in baseline by more than
+    tolerance (fraction of baseline throughput)'''
+
+    regressions = []
+    for name, entry in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]['ops_per_second']
+        if entry['ops_per_second'] < expected * (1 - tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    '''Parser for benchmark runs'''
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-sizes', '-n', type=int, nargs='+',
+                        help='message sizes of encrypt benchmarks')
+    parser.add_argument('-seed', '-s', type=int, default=0,
+                        help='random seed of benchmark messages')
+    parser.add_argument('-output', '-o',
+                        help='json file to save results to')
+    parser.add_argument('-compare', '-c',
+                        help='json file with baseline results')
+    parser.add_argument('-tolerance', '-t', type=float, default=0.1,
+                        help='allowed slowdown against baseline, default 0.1')
+    parser.add_argument('-nomemory', action='store_true',
+                        help='skip peak memory measurement')
+    args = parser.parse_args()
+
+    results = micro_benchmarks(args.seed)
+    results.update(encrypt_benchmarks(args.sizes or default_sizes,
+                                      args.seed, not args.nomemory))
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'results': results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as file_handle:
+            json.dump(report, file_handle, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+    if args.compare:
+        with open(args.compare, 'r') as file_handle:
+            baseline = json.load(file_handle)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for name in regressions:
+            print(f'Regression: {name} '
+                  f'{results[name]["ops_per_second"]:.0f} ops/s, baseline '
+                  f'{baseline[name]["ops_per_second"]:.0f} ops/s')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+'''Throughput of one shared CompiledEnigma against number of threads.
+
+Every thread encrypts its own messages through its own cursor. On
+free-threaded (no GIL) builds of CPython throughput should grow with
+threads, with the GIL it stays about flat. Run from the repository root:
+    python -m benchmarks.bench_threads -threads 1 2 4 8
+'''
+from enigma import Enigma, CompiledEnigma
+from benchmarks.bench_enigma import random_message, result
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+# Thread counts measured by default:
+default_threads = [1, 2, 4, 8]
+
+
+def gil_enabled() -> bool:
+    '''True unless running on a free-threaded build with the GIL off'''
+
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return True if is_gil_enabled is None else is_gil_enabled()
+
+
+def thread_benchmark(machine: CompiledEnigma, threads: int, streams: int,
+                     message: str) -> dict:
+    '''Encrypts streams messages, each through a new cursor, on given
+    number of threads. Returns throughput result in chars/sec'''
+
+    def encrypt_stream(_):
+        machine.cursor().encrypt(message)
+
+    with ThreadPoolExecutor(threads) as executor:
+        start = time.perf_counter()
+        list(executor.map(encrypt_stream, range(streams)))
+        seconds = time.perf_counter() - start
+    return result(seconds, streams * len(message))
+
+
+def main():
+    '''Parser for thread scaling runs'''
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-threads', '-n', type=int, nargs='+',
+                        help='thread counts to measure, default 1 2 4 8')
+    parser.add_argument('-size', '-s', type=int, default=10 ** 5,
+                        help='characters of every stream, default 100000')
+    parser.add_argument('-streams', '-m', type=int, default=32,
+                        help='number of streams encrypted, default 32')
+    parser.add_argument('-seed', type=int, default=0,
+                        help='random seed of benchmark messages')
+    parser.add_argument('-output', '-o',
+                        help='json file to save results to')
+    args = parser.parse_args()
+
+    machine = CompiledEnigma(Enigma('312', 'BCD', 'XYZ', 'B', 'AB CD EF'))
+    message = random_message(args.size, args.seed)
+    results = {
+        f'CompiledEnigma_threads_{threads}': thread_benchmark(
+            machine, threads, args.streams, message)
+        for threads in args.threads or default_threads
+    }
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'gil_enabled': gil_enabled(),
+        'results': results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as file_handle:
+            json.dump(report, file_handle, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+from exceptions import Enigma_Error
+from enigma import alphabet, state_count, Enigma, check_rotor_orders
+from concurrent.futures import ProcessPoolExecutor
+from itertools import permutations
+import os
+import time
+
+
+def create_menu(ciphertext: str, crib: str, offset: int = 0) -> list:
+    '''Creates a bombe menu from ciphertext and known plaintext (crib)
+    starting at offset letter of the ciphertext. Returns a list of
+    (plain letter index, cipher letter index, keypress) links, where
+    keypress is the number of keys pressed until the letter was encrypted'''
+
+    ciphertext = ''.join(ciphertext.split()).upper()
+    crib = ''.join(crib.split()).upper()
+
+    if offset < 0 or offset + len(crib) > len(ciphertext):
+        raise Enigma_Error('Crib does not fit in the ciphertext')
+
+    menu = []
+    for number, (plain, cipher) in enumerate(
+            zip(crib, ciphertext[offset:offset + len(crib)])):
+        if plain not in alphabet or cipher not in alphabet:
+            raise Enigma_Error(f'Invalid character in menu {plain}{cipher}')
+        if plain == cipher:
+            raise Enigma_Error(
+                f'Letter {plain} cannot be encrypted to itself, '
+                f'crib does not fit at offset {offset}')
+        menu.append((alphabet.index(plain), alphabet.index(cipher),
+                     offset + number + 1))
+    return menu
+
+
+def scrambler_tables(rotors: str, reflector_type: str,
+                     ring_setting: str = 'AAA',
+                     cache_directory: str = None) -> tuple:
+    '''Returns permutations of the machine without plugboard for every
+    packed rotor state, and the state following every state.
+    With cache_directory tables are memory mapped from a TableCache'''
+
+    enigma = Enigma(rotors, ring_setting, 'AAA', reflector_type)
+    if cache_directory is None:
+        enigma.compile(eager=True)
+        return enigma._permutations, enigma._next_state
+
+    from tablecache import TableCache
+    next_state, permutations = TableCache(cache_directory).tables(enigma)
+    scrambler = [permutations[state * 26:state * 26 + 26]
+                 for state in range(len(next_state))]
+    return scrambler, next_state
+
+
+def _propagate(steckers: list, letter: int, partner: int,
+               adjacency: list, scramblers: list) -> bool:
+    '''Connects letter with partner on the plugboard and follows menu
+    links to all implied connections. Returns False on contradiction'''
+
+    stack = [(letter, partner)]
+    while stack:
+        letter, partner = stack.pop()
+        if steckers[letter] == partner:
+            continue
+        if steckers[letter] != -1 or steckers[partner] not in (-1, letter):
+            return False
+
+        steckers[letter] = partner
+        steckers[partner] = letter
+        for other, link in adjacency[letter]:
+            stack.append((other, scramblers[link][partner]))
+        if partner != letter:
+            for other, link in adjacency[partner]:
+                stack.append((other, scramblers[link][letter]))
+    return True
+
+
+def _find_steckers(test_letters: list, adjacency: list,
+                   scramblers: list) -> list:
+    '''Tries every plugboard partner of the test letter of each menu
+    component. Returns the first consistent plugboard as a list of
+    partner indexes (-1 for undetermined letters) or None'''
+
+    def search(number: int, steckers: list) -> list:
+        if number == len(test_letters):
+            return steckers
+        test_letter = test_letters[number]
+        if steckers[test_letter] != -1:
+            return search(number + 1, steckers)
+        for hypothesis in range(26):
+            trial = steckers[:]
+            if _propagate(trial, test_letter, hypothesis,
+                          adjacency, scramblers):
+                result = search(number + 1, trial)
+                if result:
+                    return result
+        return None
+
+    return search(0, [-1] * 26)
+
+
+def _menu_graph(menu: list) -> tuple:
+    '''Returns menu adjacency list (other letter, link number) of every
+    letter and the most connected letter of every menu component'''
+
+    adjacency = [[] for _ in range(26)]
+    for link, (plain, cipher, _) in enumerate(menu):
+        adjacency[plain].append((cipher, link))
+        adjacency[cipher].append((plain, link))
+
+    test_letters = []
+    visited = set()
+    for letter in sorted(range(26), key=lambda x: -len(adjacency[x])):
+        if letter in visited or not adjacency[letter]:
+            continue
+        test_letters.append(letter)
+        stack = [letter]
+        while stack:
+            current = stack.pop()
+            if current not in visited:
+                visited.add(current)
+                stack.extend(other for other, _ in adjacency[current])
+    return adjacency, test_letters
+
+
+def plugboard_from_steckers(steckers: list) -> str:
+    '''Converts a list of partner indexes to plugboard string'''
+
+    return ' '.join(
+        alphabet[letter] + alphabet[partner]
+        for letter, partner in enumerate(steckers)
+        if letter < partner
+    )
+
+
+def _search_rotor_order(rotors: str, reflector_type: str, ring_setting: str,
+                        menu: list, cache_directory: str = None) -> list:
+    '''Process pool worker, runs the bombe over all starting positions
+    of one rotor order. Returns a list of (position, steckers) stops'''
+
+    scrambler, next_state = scrambler_tables(
+        rotors, reflector_type, ring_setting, cache_directory)
+    adjacency, test_letters = _menu_graph(menu)
+
+    # States of every starting position at menu keypresses, keypresses
+    # of the menu are distinct and ascending:
+    keypresses = [keypress for _, _, keypress in menu]
+    states = list(range(state_count))
+    link_states = []
+    for keypress in range(1, max(keypresses) + 1):
+        states = [next_state[state] for state in states]
+        if keypress in keypresses:
+            link_states.append(states)
+
+    stops = []
+    for start in range(state_count):
+        scramblers = [scrambler[states[start]] for states in link_states]
+        steckers = _find_steckers(test_letters, adjacency, scramblers)
+        if steckers:
+            left, start = divmod(start, 676)
+            middle, right = divmod(start, 26)
+            position = alphabet[left] + alphabet[middle] + alphabet[right]
+            stops.append((position, steckers))
+    return stops
+
+
+def bombe(ciphertext: str, crib: str, offset: int = 0,
+          reflector_type: str = 'B', rotor_orders: list = None,
+          ring_setting: str = 'AAA', workers: int = None,
+          cache_directory: str = None) -> tuple:
+    '''Searches for machine settings that encrypt the crib to the
+    ciphertext starting at offset letter, over all starting positions of
+    given rotor orders (default: all 60 orders of rotors 1-5).
+    Rotor orders are split between worker processes, which load compiled
+    tables from a TableCache in cache_directory if given.
+    Returns a list of settings dictionaries (keys as written by
+    save_settings_to_json, plugboard as implied by the menu) and
+    statistics dictionary with number of positions and positions/sec'''
+
+    menu = create_menu(ciphertext, crib, offset)
+    crib = ''.join(crib.split()).upper()
+    ciphertext = ''.join(ciphertext.split()).upper()
+    reflector_type = reflector_type.upper()
+    rotor_orders = rotor_orders or [
+        ''.join(order) for order in permutations('12345', 3)
+    ]
+    check_rotor_orders(rotor_orders)
+
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(workers or os.cpu_count()) as executor:
+        futures = [
+            executor.submit(_search_rotor_order, rotors, reflector_type,
+                            ring_setting, menu, cache_directory)
+            for rotors in rotor_orders
+        ]
+        stops = [(rotors, future.result())
+                 for rotors, future in zip(rotor_orders, futures)]
+    seconds = time.perf_counter() - start_time
+
+    # Only stops that really decrypt the crib are reported:
+    results = []
+    for rotors, rotor_order_stops in stops:
+        for position, steckers in rotor_order_stops:
+            settings = {
+                'rotors': rotors,
+                'ring_setting': ring_setting,
+                'position': position,
+                'reflector': reflector_type,
+                'plugboard': plugboard_from_steckers(steckers)
+            }
+            enigma = Enigma(rotors, ring_setting, position, reflector_type,
+                            settings['plugboard'])
+            enigma.seek(offset)
+            decrypted = enigma.encrypt(ciphertext[offset:offset + len(crib)])
+            if decrypted.replace(' ', '') == crib:
+                results.append(settings)
+
+    positions = len(rotor_orders) * state_count
+    statistics = {
+        'positions': positions,
+        'seconds': seconds,
+        'positions_per_second': positions / seconds if seconds else 0.0
+    }
+    return results, statistics
@@ -1,9 +1,50 @@
 from exceptions import Rotor_Error, Plugboard_Error, Enigma_Error
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from functools import lru_cache
 import argparse
+import asyncio
 import json
+import mmap
+import os
+import sys
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
 
+# Default number of characters the command line reads at once:
+default_chunk_size = 2 ** 20
+
+# Characters skipped and accepted by encrypt_file_mmap:
+mmap_whitespace = b' \t\n'
+mmap_letters = (alphabet + alphabet.lower()).encode('ascii')
+
+# Maximal number of messages encrypt_batch puts in a single array:
+batch_size = 1024
+
+# Buffers shorter than this are encrypted by encrypt_into without numpy:
+into_array_size = 128
+
+# Maximal number of (rotor type, ring setting) wirings kept compiled:
+wiring_cache_size = 256
+
+# Number of distinct rotor states of a three rotor machine:
+state_count = 26 ** 3
+
+# Translation of letter index bytes to capital letters, other bytes
+# (like spaces) are kept:
+index_letters = alphabet.encode('ascii') + bytes(range(26, 256))
+
+# Letter to index lookup, accepts both cases:
+letter_index = {letter: index for index, letter in enumerate(alphabet)}
+letter_index.update(
+    {letter.lower(): index for index, letter in enumerate(alphabet)})
+
 rotor = {
     '1': {
         'cipher': 'EKMFLGDQVZNTOWYHXUSPAIBRCJ',
@@ -24,13 +65,40 @@ rotor = {
     '5': {
         'cipher': 'VZBRGITYUPSDNHLXAWMJQOFECK',
         'notch': 'Z'
+    },
+    '6': {
+        'cipher': 'JPGVOUMFYQBENHZRDKASXLICTW',
+        'notch': 'ZM'
+    },
+    '7': {
+        'cipher': 'NZJHGRCXMYSWBOUFAIVLPEKQDT',
+        'notch': 'ZM'
+    },
+    '8': {
+        'cipher': 'FKQHTLXOCBJSPDZRAMEWNIUYGV',
+        'notch': 'ZM'
+    },
+    # Thin Beta and Gamma rotors of the four rotor M4 machine, they stand
+    # left of the stepping rotors and never turn:
+    'B': {
+        'cipher': 'LEYJVCNIXWPBQMDRTAKZGFUHOS',
+        'notch': '',
+        'fixed': True
+    },
+    'G': {
+        'cipher': 'FSOKANUERHMBTIYCWLQPZXVGJD',
+        'notch': '',
+        'fixed': True
     }
 }
 
 reflector = {
     'A': 'EJMZALYXVBWFCRQUONTSPIKHGD',
     'B': 'YRUHQSLDPXNGOKMIEBFZCWVJAT',
-    'C': 'FVPJIAOYEDRZXWGCTKUQSBNMHL'
+    'C': 'FVPJIAOYEDRZXWGCTKUQSBNMHL',
+    # Thin reflectors of the M4, used together with a thin rotor:
+    'BT': 'ENKQAUYWJICOPBLMDXZVFTHRGS',
+    'CT': 'RDOBJNTKVEHMLFCWZAXGYIPSUQ'
 }
 
 
@@ -77,10 +145,12 @@ def create_plugboard_dict(string: str) -> dict:
     for pair in string.split(' '):
         pair = pair.upper()
 
-        if pair[0] == pair[1]:
-            raise Plugboard_Error('A letter cannot be connected to itself')
         if not len(pair) == 2:
             raise Plugboard_Error('Plugboard connection must link two letters')
+        if pair[0] not in alphabet or pair[1] not in alphabet:
+            raise Plugboard_Error(f'Invalid plugboard letter in {pair}')
+        if pair[0] == pair[1]:
+            raise Plugboard_Error('A letter cannot be connected to itself')
         if pair[0] in plugboard.keys() or pair[1] in plugboard.keys():
             raise Plugboard_Error('A single letter can be connected only once')
 
@@ -91,8 +161,14 @@ def create_plugboard_dict(string: str) -> dict:
 
 def enigma_from_json(path: str) -> object:
     '''Creates Enigma object with settings from json file'''
-    file_handle = open(path, 'r')
-    settings = json.load(file_handle)
+    with open(path, 'r') as file_handle:
+        settings = json.load(file_handle)
+    return enigma_from_settings(settings)
+
+
+def enigma_from_settings(settings: dict) -> object:
+    '''Creates Enigma object from settings dictionary, keys as
+    written by save_settings_to_json'''
 
     rotors = settings['rotors'] or '123'
     ringset = settings['ring_setting'] or 'AAA'
@@ -104,12 +180,223 @@ def enigma_from_json(path: str) -> object:
     return resulting_enigma
 
 
+def _check_settings(rotors: str, ring_setting: str, starting_position: str,
+                    reflector_type: str, plugboard: str) -> tuple:
+    '''Validates Enigma settings, raises TypeError or ValueError.
+    Returns rotors, ring setting, starting position and reflector type
+    converted to capital letters'''
+
+    if not type(rotors) == str:
+        raise TypeError('Invalid input type (rotors)')
+    if not type(ring_setting) == str:
+        raise TypeError('Invalid input type (ring setting)')
+    if not type(starting_position) == str:
+        raise TypeError('Invalid input type (starting position)')
+    if not type(reflector_type) == str:
+        raise TypeError('Invalid input type (reflector type)')
+    if not type(plugboard) == str:
+        raise TypeError('Invalid input type (plugboard)')
+
+    rotors = rotors.upper()
+    ring_setting = ring_setting.upper()
+    starting_position = starting_position.upper()
+    reflector_type = reflector_type.upper()
+
+    if not len(rotors):
+        raise ValueError('Invalid input length (rotors)')
+    for number in rotors:
+        if number not in rotor:
+            raise ValueError('Invalid input value (rotors)')
+    # Fixed rotors can only stand left of at least one stepping rotor:
+    fixed = [rotor[number].get('fixed', False) for number in rotors]
+    if fixed[-1] or fixed != sorted(fixed, reverse=True):
+        raise ValueError('Invalid input value (rotors)')
+    if not len(ring_setting) == len(rotors):
+        raise ValueError('Invalid input length (ring setting)')
+    for letter in ring_setting:
+        if letter not in alphabet:
+            raise ValueError('Invalid input value (ring setting)')
+    if not len(starting_position) == len(rotors):
+        raise ValueError('Invalid input length (starting position)')
+    for letter in starting_position:
+        if letter not in alphabet:
+            raise ValueError('Invalid input value (starting position)')
+    if reflector_type not in reflector:
+        raise ValueError('Invalid input value (reflector type)')
+
+    return rotors, ring_setting, starting_position, reflector_type
+
+
+def _positions_after(left, middle, right, middle_notch: int,
+                     right_notch: int, presses) -> tuple:
+    '''Returns rotor positions after given number of keypresses without
+    stepping through them. Works on ints as well as on numpy arrays
+    of keypress counts (at least 1). Mirrors Enigma.turn, including
+    double stepping'''
+
+    # A middle rotor starting at its notch steps on the first keypress,
+    # after that it can only reach the notch by a right rotor turnover.
+    # Written without branching, so that starting positions can be arrays:
+    at_notch = (middle == middle_notch)
+    left = (left + at_notch) % 26
+    middle = (middle + at_notch * (1 + (right == right_notch))) % 26
+    right = (right + at_notch) % 26
+    presses = presses - at_notch
+
+    # Keypress of the first right rotor turnover, then every 26:
+    first_turnover = (right_notch - right) % 26 + 1
+    turnovers = (presses - first_turnover + 26) // 26
+
+    # Keypress of the first double step, right after the turnover that
+    # brings the middle rotor to its notch, then every 25 turnovers:
+    first_double_step = \
+        first_turnover + 26 * ((middle_notch - middle) % 26 - 1) + 1
+    double_steps = ((presses - first_double_step) // 650 + 1) * \
+        (presses >= first_double_step)
+
+    return ((left + double_steps) % 26,
+            (middle + turnovers + double_steps) % 26,
+            (right + presses) % 26)
+
+
+def _closed_form(rotor_types: str) -> bool:
+    '''True if stepping of given stepping rotors is computed by
+    _positions_after: three rotors, middle and right with a single notch'''
+
+    return len(rotor_types) == 3 and all(
+        len(rotor[rotor_type]['notch']) == 1 and
+        not rotor[rotor_type].get('fixed', False)
+        for rotor_type in rotor_types)
+
+
+def check_rotor_orders(rotor_orders: list) -> None:
+    '''Raises Enigma_Error unless every rotor order is three stepping
+    rotors, the machines modelled by the key searches (keysearch, bombe).
+    Thin rotors never step'''
+
+    for rotors in rotor_orders:
+        if not type(rotors) == str or not len(rotors) == 3 or not all(
+                rotor_type in rotor and
+                not rotor[rotor_type].get('fixed', False)
+                for rotor_type in rotors):
+            raise Enigma_Error(
+                f'Rotor order {rotors} is not three stepping rotors')
+
+
+def _require_closed_form(rotor_types: str) -> None:
+    '''Raises ValueError unless stepping of given rotors is computed by
+    _positions_after, as the array functions built on it need'''
+
+    if not all(rotor_type in rotor for rotor_type in rotor_types) or \
+            not _closed_form(rotor_types):
+        raise ValueError(f'Rotors {rotor_types} are not three stepping '
+                         'rotors with a single notch, use Enigma')
+
+
+def _group_array(letters: object, separator: int = 0) -> tuple:
+    '''Inserts a space after every 5 letters of a numpy uint8 array.
+    Separator is the number of letters already in the first group.
+    Returns grouped array and the number of letters in the last group'''
+
+    # Letters completing the group started before:
+    head_length = min((5 - separator) % 5, len(letters))
+    head = letters[:head_length]
+    if separator and head_length == 5 - separator:
+        head = numpy.append(head, numpy.uint8(32))
+        separator = 0
+    else:
+        separator += head_length
+    if separator:
+        return head, separator
+    letters = letters[head_length:]
+
+    full_groups = len(letters) // 5
+    grouped = numpy.empty((full_groups, 6), dtype=numpy.uint8)
+    grouped[:, :5] = letters[:full_groups * 5].reshape(full_groups, 5)
+    grouped[:, 5] = 32
+    rest = letters[full_groups * 5:]
+    return numpy.concatenate((head, grouped.ravel(), rest)), len(rest)
+
+
+@lru_cache(maxsize=wiring_cache_size)
+def _compile_wiring(rotor_type: str, ring_setting: str) -> tuple:
+    '''Builds the integer lookup tables of a rotor with given ring setting.
+    Returns forward (right in left out) and inverse (left in right out)
+    tables indexed by [position][letter index], and a tuple of notch
+    indexes.
+    Tables are tuples, so machines can share them. Results are cached'''
+
+    ring = alphabet.index(ring_setting)
+    wiring = [alphabet.index(letter) for letter in rotor[rotor_type]['cipher']]
+
+    forward = []
+    inverse = []
+    for position in range(26):
+        shift = position - ring
+        forward_table = [
+            (wiring[(index + shift) % 26] - shift) % 26
+            for index in range(26)
+        ]
+        inverse_table = [0] * 26
+        for index, letter in enumerate(forward_table):
+            inverse_table[letter] = index
+        forward.append(tuple(forward_table))
+        inverse.append(tuple(inverse_table))
+
+    notches = tuple((alphabet.index(notch) - ring) % 26
+                    for notch in rotor[rotor_type]['notch'])
+    return tuple(forward), tuple(inverse), notches
+
+
+@lru_cache(maxsize=None)
+def _compile_reflector(reflector_type: str) -> tuple:
+    '''Returns the letter index table of a reflector, cached'''
+
+    return tuple(letter_index[letter] for letter in reflector[reflector_type])
+
+
+def _letter_indexes(letters: object) -> object:
+    '''Returns letter indexes of a numpy uint8 array of ASCII letters,
+    whitespace is skipped. Raises Enigma_Error for other characters'''
+
+    letters = numpy.asarray(letters, dtype=numpy.uint8)
+    letters = letters[(letters != 32) & (letters != 9) & (letters != 10)]
+    indexes = numpy.where(letters >= 97, letters - 97, letters - 65)
+    invalid = numpy.flatnonzero(indexes >= 26)
+    if len(invalid):
+        char = chr(letters[invalid[0]])
+        raise Enigma_Error(f'Invalid character to encypt {char}')
+    return indexes
+
+
+@lru_cache(maxsize=wiring_cache_size)
+def _wiring_arrays(rotor_type: str, ring_setting: str) -> tuple:
+    '''Returns forward and inverse tables of _compile_wiring as read-only
+    numpy arrays for bulk encryption, cached'''
+
+    forward, inverse, _ = _compile_wiring(rotor_type, ring_setting)
+    return _index_array(forward), _index_array(inverse)
+
+
+@lru_cache(maxsize=wiring_cache_size)
+def _index_array(table: tuple) -> object:
+    '''Returns a letter index table (or tuple of tables) as a read-only
+    numpy array, cached'''
+
+    array = numpy.array(table, dtype=numpy.intp)
+    array.flags.writeable = False
+    return array
+
+
 class Rotor:
     '''Simulates Enigma Rotor
-        rotor_type:         one character, 1-5
+        rotor_type:         one character, 1-8, B (Beta) or G (Gamma)
         ring_setting:       one character, A-Z
         starting_letter:    one character, A-Z
     '''
+    __slots__ = ('_rotor_type', '_ring_setting', '_position',
+                 '_forward', '_inverse', '_notches')
+
     def __init__(self, rotor_type: str, ring_setting: str,
                  starting_letter: str):
 
@@ -121,38 +408,46 @@ class Rotor:
         if rotor_type not in rotor.keys():
             raise Rotor_Error(f'{rotor_type} is not a valid rotor name')
 
-        # Setting the rotor parameters:
+        # Setting the rotor parameters. Position and notches are kept
+        # as letter indexes, wiring as precomputed lookup tables:
         self._rotor_type = rotor_type
         self._ring_setting = ring_setting.upper()
-        self._position = 'A'
-        self._cipher = rotor[rotor_type]['cipher']
-        self._notch = rotor[rotor_type]['notch']
-
-        # Setting rotor position and ring setting:
-        ring_shift = -1 * alphabet.index(self._ring_setting)
-        self._shift_cipher(ring_shift)
-        self._notch = caesar_shift(self._notch, ring_shift)
+        self._position = 0
+        self._forward, self._inverse, self._notches = _compile_wiring(
+            rotor_type, self._ring_setting)
         self.set_position(starting_letter.upper())
 
-    # Rotor turn methods:
+    def _copy(self) -> object:
+        '''Private, returns a copy of the rotor sharing wiring tables'''
 
-    def _shift_cipher(self, shift_value: int) -> None:
-        '''Shifts the rotor cipher to left and by caesar cipher'''
+        copy = Rotor.__new__(Rotor)
+        copy._rotor_type = self._rotor_type
+        copy._ring_setting = self._ring_setting
+        copy._position = self._position
+        copy._forward = self._forward
+        copy._inverse = self._inverse
+        copy._notches = self._notches
+        return copy
 
-        shift_value %= 26
-        self._cipher = caesar_shift(self._cipher, -1 * shift_value)
-        self._cipher = self._cipher[shift_value:] + self._cipher[0:shift_value]
+    # Rotor turn methods:
 
     def turn(self) -> bool:
         '''Turns the rotor, returns true if reached the notch'''
 
-        turnover = (self._position == self._notch)
-        self._shift_cipher(1)
-        self._position = shift_char(self._position, 1)
+        turnover = self._position in self._notches
+        self._position = (self._position + 1) % 26
         return turnover
 
     # Encryption methods:
 
+    def forward(self, index: int) -> int:
+        '''Right in left out encryption of a letter index'''
+        return self._forward[self._position][index]
+
+    def inverse(self, index: int) -> int:
+        '''Left in right out encryption of a letter index'''
+        return self._inverse[self._position][index]
+
     def liro(self, char: str) -> str:
         '''Left in right out character encryption'''
 
@@ -163,8 +458,7 @@ class Rotor:
         if char.upper() not in alphabet:
             raise ValueError('Invalid character')
 
-        letter = self._cipher.index(char.upper())
-        return alphabet[letter]
+        return alphabet[self.inverse(alphabet.index(char.upper()))]
 
     def rilo(self, char: str) -> str:
         '''Right in left out character encryption'''
@@ -176,8 +470,7 @@ class Rotor:
         if char.upper() not in alphabet:
             raise ValueError('Invalid character')
 
-        letter = alphabet.index(char)
-        return self._cipher[letter]
+        return alphabet[self.forward(alphabet.index(char.upper()))]
 
     # Getters:
 
@@ -187,7 +480,7 @@ class Rotor:
 
     def position(self) -> str:
         '''Returns current position (letter)'''
-        return self._position
+        return alphabet[self._position]
 
     def ring_setting(self) -> str:
         '''Returns ring setting of the rotor (letter)'''
@@ -195,10 +488,7 @@ class Rotor:
 
     def at_notch(self) -> bool:
         '''True if rotor at notch position'''
-        if self._position == self._notch:
-            return True
-        else:
-            return False
+        return self._position in self._notches
 
     # Setters:
 
@@ -212,68 +502,89 @@ class Rotor:
         if len(new_position) > 1:
             raise ValueError('New position must be a single letter!')
 
-        new_position = new_position.upper()
-        jump = alphabet.index(new_position) - alphabet.index(self._position)
-        jump %= 26
-        self._shift_cipher(jump)
-        self._position = new_position
+        self._position = alphabet.index(new_position.upper())
+
+
+class EnigmaStats:
+    '''Counters and sampled stage timings collected by Enigma.profile
+        sample_rate:    every how many keypresses stages are timed
+    '''
+    def __init__(self, sample_rate: int = 64):
+        self.sample_rate = sample_rate
+        self.keypresses = 0
+        self.rotor_turns = 0
+        self.double_steps = 0
+        self.plugboard_hits = 0
+        self.samples = 0
+        self.seconds = {
+            'stepping': 0.0,
+            'plugboard': 0.0,
+            'rotors': 0.0,
+            'reflector': 0.0
+        }
+
+    def estimated_seconds(self) -> dict:
+        '''Returns time spent in every stage scaled from samples
+        to all keypresses'''
+
+        scale = self.keypresses / self.samples if self.samples else 0.0
+        return {stage: seconds * scale
+                for stage, seconds in self.seconds.items()}
+
+    def as_dict(self) -> dict:
+        '''Returns all counters and timings as a dictionary'''
+
+        return {
+            'keypresses': self.keypresses,
+            'rotor_turns': self.rotor_turns,
+            'double_steps': self.double_steps,
+            'plugboard_hits': self.plugboard_hits,
+            'samples': self.samples,
+            'sampled_seconds': dict(self.seconds),
+            'estimated_seconds': self.estimated_seconds()
+        }
 
 
 class Enigma:
     '''Simulates an Enigma encryption machine.
 
-    rotors:             3 numbers 1-5, default 123
-    ring_setting:       3 letters A-Z, default AAA
-    starting_position:  3 letters A-Z, default AAA
-    reflector_type:     1 letter A-C, default A
+    rotors:             rotor types from left to right, 1-8, thin rotors
+                        B (Beta) or G (Gamma) only leftmost, default 123
+    ring_setting:       a letter A-Z for every rotor, default AAA
+    starting_position:  a letter A-Z for every rotor, default AAA
+    reflector_type:     A, B, C or thin BT, CT, default A
     plugboard:          optional, pairs of letters divided by spaces A-Z
+
+    Thin rotors never turn, their wiring is folded into the reflector,
+    so a four rotor M4 machine runs at the speed of a three rotor one
     '''
+    __slots__ = ('_rotors', '_fixed_rotors', '_reflector', '_plugboard',
+                 '_plugboard_table', '_next_state', '_permutations',
+                 '_settings_dict', '_stats')
+
     def __init__(self, rotors: str = '123', ring_setting: str = 'AAA',
                  starting_position: str = 'AAA', reflector_type: str = 'A',
                  plugboard: str = '') -> object:
 
-        if not type(rotors) == str:
-            raise TypeError('Invalid input type (rotors)')
-        if not type(ring_setting) == str:
-            raise TypeError('Invalid input type (ring setting)')
-        if not type(starting_position) == str:
-            raise TypeError('Invalid input type (starting position)')
-        if not type(reflector_type) == str:
-            raise TypeError('Invalid input type (reflector type)')
-        if not type(plugboard) == str:
-            raise TypeError('Invalid input type (plugboard)')
-
-        ring_setting = ring_setting.upper()
-        starting_position = starting_position.upper()
-        reflector_type = reflector_type.upper()
-
-        if not len(rotors) == 3:
-            raise ValueError('Invalid input length (rotors)')
-        for number in rotors:
-            if number not in '12345':
-                raise ValueError('Invalid input value (rotors)')
-        if not len(ring_setting) == 3:
-            raise ValueError('Invalid input length (ring setting)')
-        for letter in ring_setting:
-            if letter not in alphabet:
-                raise ValueError('Invalid input value (ring setting)')
-        if not len(starting_position) == 3:
-            raise ValueError('Invalid input length (starting position)')
-        for letter in starting_position:
-            if letter not in alphabet:
-                raise ValueError('Invalid input value (starting position)')
-        if reflector_type not in 'ABC':
-            raise ValueError('Invalid input value (reflector type)')
-        if not len(reflector_type) == 1:
-            raise ValueError('Invali input length (reflector type)')
+        rotors, ring_setting, starting_position, reflector_type = \
+            _check_settings(rotors, ring_setting, starting_position,
+                            reflector_type, plugboard)
 
-        self._rotors = [
+        machine_rotors = [
             Rotor(rtype, ring, letter)
             for rtype, ring, letter
             in zip(rotors, ring_setting, starting_position)
         ]
-        self._reflector = reflector[reflector_type]
+        fixed = sum(rotor[rtype].get('fixed', False) for rtype in rotors)
+        self._fixed_rotors = machine_rotors[:fixed]
+        self._rotors = machine_rotors[fixed:]
+        self._reflector = self._fold_reflector(
+            _compile_reflector(reflector_type))
         self._plugboard = create_plugboard_dict(plugboard)
+        self._next_state = None
+        self._permutations = None
+        self._stats = None
+        self._update_plugboard_table()
 
         # Settings dictionary:
         self._settings_dict = {}
@@ -283,68 +594,644 @@ class Enigma:
         self._settings_dict['reflector'] = reflector_type
         self._settings_dict['plugboard'] = self.plugboard_string
 
+    def _fold_reflector(self, reflector_table: tuple) -> tuple:
+        '''Private, returns reflector table combined with the fixed rotors
+        standing next to it'''
+
+        if not self._fixed_rotors:
+            return reflector_table
+        table = []
+        for index in range(26):
+            for fixed_rotor in reversed(self._fixed_rotors):
+                index = fixed_rotor.forward(index)
+            index = reflector_table[index]
+            for fixed_rotor in self._fixed_rotors:
+                index = fixed_rotor.inverse(index)
+            table.append(index)
+        return tuple(table)
+
+    def _has_closed_form(self) -> bool:
+        '''Private, true if _positions_after applies to the rotors'''
+        return _closed_form(''.join(
+            rotor._rotor_type for rotor in self._rotors))
+
     def turn(self) -> None:
-        '''Turns the rotors of the machine'''
+        '''Turns the rotors of the machine. The right rotor turns on every
+        keypress, a rotor at its notch turns its left neighbour and itself
+        (the right rotor only once)'''
+
+        rotors = self._rotors
+        at_notch = [machine_rotor.at_notch() for machine_rotor in rotors]
+        for number in range(1, len(rotors)):
+            if at_notch[number]:
+                rotors[number - 1].turn()
+                if number < len(rotors) - 1:
+                    rotors[number].turn()
+        rotors[-1].turn()
+
+    def state_at(self, presses: int) -> str:
+        '''Returns the position of rotors after given number of
+        keypresses, without turning the rotors'''
+
+        if not type(presses) == int:
+            raise TypeError('Number of keypresses must be an integer')
+        if presses < 0:
+            raise ValueError('Number of keypresses cannot be negative')
+        if presses == 0:
+            return self.position()
+
+        if self._has_closed_form():
+            left, middle, right = self._rotors
+            positions = _positions_after(
+                left._position, middle._position, right._position,
+                middle._notches[0], right._notches[0], presses)
+        else:
+            positions = self._state_positions(
+                self._state_after(self._state_index(), presses))
+        fixed = ''.join(
+            fixed_rotor.position() for fixed_rotor in self._fixed_rotors)
+        return fixed + ''.join(alphabet[position] for position in positions)
+
+    def seek(self, presses: int) -> None:
+        '''Turns the rotors as if given number of keys was pressed'''
+
+        positions = self.state_at(presses)[len(self._fixed_rotors):]
+        for machine_rotor, letter in zip(self._rotors, positions):
+            machine_rotor.set_position(letter)
+
+    def _state_after(self, state: int, presses: int) -> int:
+        '''Private, returns packed state after given number of keypresses
+        by stepping, whole cycles of rotor states are skipped'''
+
+        first_press = {}
+        states = []
+        for press in range(presses):
+            if state in first_press:
+                cycle_start = first_press[state]
+                cycle_length = press - cycle_start
+                return states[
+                    cycle_start + (presses - cycle_start) % cycle_length]
+            first_press[state] = press
+            states.append(state)
+            state = self._step_state(state)
+        return state
+
+    @contextmanager
+    def profile(self, sample_rate: int = 64) -> object:
+        '''Context manager, counts keypresses, rotor turns, double steps
+        and plugboard hits of encrypt_char, encrypt and encrypt_stream
+        calls inside it, and times their stages every sample_rate
+        keypresses. Yields EnigmaStats object. Compiled mode is suspended
+        while profiling. Outside of it encryption is not instrumented'''
+
+        stats = EnigmaStats(sample_rate)
+        permutations = self._permutations
+        plugboard_table = list(self._plugboard_table)
+        self._stats = stats
+        self._permutations = None
+        try:
+            yield stats
+        finally:
+            self._stats = None
+            if permutations is not None:
+                if self._plugboard_table != plugboard_table:
+                    permutations = [None] * len(permutations)
+                self._permutations = permutations
 
-        if self._rotors[1].at_notch():
-            self._rotors[1].turn()
-            self._rotors[0].turn()
+    # Encryption:
 
-        if self._rotors[2].turn():
-            self._rotors[1].turn()
+    def _encrypt_function(self) -> object:
+        '''Private, returns the method encrypting a letter index'''
+
+        if self._stats is not None:
+            return self._encrypt_index_profiled
+        if len(self._rotors) == 3:
+            return self._encrypt_index
+        return self._encrypt_index_general
+
+    def _encrypt_index(self, index: int) -> int:
+        '''Private, turns the rotors and encrypts a letter index,
+        three stepping rotors only'''
+
+        left, middle, right = self._rotors
+        if middle._position in middle._notches:
+            middle._position = (middle._position + 1) % 26
+            left._position = (left._position + 1) % 26
+        if right._position in right._notches:
+            middle._position = (middle._position + 1) % 26
+        right._position = (right._position + 1) % 26
+
+        index = self._plugboard_table[index]
+        index = right._forward[right._position][index]
+        index = middle._forward[middle._position][index]
+        index = left._forward[left._position][index]
+        index = self._reflector[index]
+        index = left._inverse[left._position][index]
+        index = middle._inverse[middle._position][index]
+        index = right._inverse[right._position][index]
+        return self._plugboard_table[index]
+
+    def _encrypt_index_general(self, index: int) -> int:
+        '''Private, _encrypt_index of any number of stepping rotors'''
 
-    # Encryption:
+        self.turn()
+        rotors = self._rotors
+        index = self._plugboard_table[index]
+        for machine_rotor in reversed(rotors):
+            index = machine_rotor._forward[machine_rotor._position][index]
+        index = self._reflector[index]
+        for machine_rotor in rotors:
+            index = machine_rotor._inverse[machine_rotor._position][index]
+        return self._plugboard_table[index]
+
+    def _encrypt_index_profiled(self, index: int) -> int:
+        '''Private, _encrypt_index counting stages into profile stats,
+        every sample_rate keypress is also timed'''
+
+        stats = self._stats
+        stats.keypresses += 1
+        rotors = self._rotors
+        sampled = stats.keypresses % stats.sample_rate == 0
+        if sampled:
+            stats.samples += 1
+            start = time.perf_counter()
+
+        stats.rotor_turns += 1
+        for number in range(1, len(rotors)):
+            if rotors[number].at_notch():
+                if number < len(rotors) - 1:
+                    stats.double_steps += 1
+                    stats.rotor_turns += 2
+                else:
+                    stats.rotor_turns += 1
+        self.turn()
+        if sampled:
+            stepped = time.perf_counter()
+
+        plugged = self._plugboard_table[index]
+        stats.plugboard_hits += (plugged != index)
+        if sampled:
+            plugboard_in = time.perf_counter()
+
+        index = plugged
+        for machine_rotor in reversed(rotors):
+            index = machine_rotor.forward(index)
+        if sampled:
+            rotors_in = time.perf_counter()
+
+        index = self._reflector[index]
+        if sampled:
+            reflected = time.perf_counter()
+
+        for machine_rotor in rotors:
+            index = machine_rotor.inverse(index)
+        if sampled:
+            rotors_out = time.perf_counter()
+
+        plugged = self._plugboard_table[index]
+        stats.plugboard_hits += (plugged != index)
+        if sampled:
+            end = time.perf_counter()
+            stats.seconds['stepping'] += stepped - start
+            stats.seconds['plugboard'] += \
+                (plugboard_in - stepped) + (end - rotors_out)
+            stats.seconds['rotors'] += \
+                (rotors_in - plugboard_in) + (rotors_out - reflected)
+            stats.seconds['reflector'] += reflected - rotors_in
+        return plugged
 
     def encrypt_char(self, char: str) -> str:
         '''Encrypts a single character'''
 
-        self.turn()
         letter = char.upper()
-        letter = self._plugboardyse(letter)
-        letter = self._rotors[2].rilo(letter)
-        letter = self._rotors[1].rilo(letter)
-        letter = self._rotors[0].rilo(letter)
-        letter = self._reflector[alphabet.index(letter)]
-        letter = self._rotors[0].liro(letter)
-        letter = self._rotors[1].liro(letter)
-        letter = self._rotors[2].liro(letter)
-        letter = self._plugboardyse(letter)
-        return letter
+        if letter not in letter_index:
+            raise ValueError('Input value not valid')
+        return alphabet[self._encrypt_function()(letter_index[letter])]
 
     def encrypt(self, string: str) -> str:
         '''Encrypts a message letter by letter, groups
         result string by 5 characters'''
 
-        encrypted_message = ''
+        return self._encrypt_chunk(string, 0)[0]
+
+    def encrypt_stream(self, chunks: object) -> object:
+        '''Generator, encrypts an iterable of message chunks and yields
+        encrypted chunks. Grouping by 5 characters continues across chunk
+        boundaries, so joined result is the same as encrypt of whole text'''
+
         separator = 0
+        for chunk in chunks:
+            encrypted_chunk, separator = self._encrypt_chunk(chunk, separator)
+            yield encrypted_chunk
+
+    def _encrypt_chunk(self, string: str, separator: int) -> tuple:
+        '''Private, encrypts a part of a message. Separator is the number
+        of letters in the last, unfinished group of previous part.
+        Returns encrypted part and the separator for the next part'''
+
+        if self._permutations is not None:
+            return self._encrypt_compiled(string, separator)
+
+        encrypted_message = []
+        encrypt_index = self._encrypt_function()
 
         for char in string:
             if char in (' ', '\t', '\n'):
                 continue
-            if char.upper() not in alphabet:
+            if char not in letter_index:
                 raise Enigma_Error(f'Invalid character to encypt {char}')
 
-            encrypted_message += self.encrypt_char(char.upper())
+            encrypted_message.append(
+                alphabet[encrypt_index(letter_index[char])])
             separator += 1
 
             if separator == 5:
                 separator = 0
-                encrypted_message += ' '
+                encrypted_message.append(' ')
 
-        return encrypted_message
+        return ''.join(encrypted_message), separator
 
-    def _plugboardyse(self, letter: str) -> str:
-        '''Private, passes letter through plugboard
-        or returns it unchanged if not connected'''
+    # Bulk encryption:
 
-        result = letter.upper()
+    def encrypt_array(self, letters: object) -> object:
+        '''Encrypts a numpy uint8 array of ASCII letters at once, requires
+        numpy. Whitespace is skipped like in encrypt, the result is an
+        array of encrypted capital letters without grouping'''
 
-        if result not in alphabet:
-            raise ValueError('Input value not valid')
+        if numpy is None:
+            raise ImportError('encrypt_array requires numpy')
 
-        if result in self._plugboard.keys():
-            result = self._plugboard[result]
-        return result
+        indexes = self._encrypt_indexes(_letter_indexes(letters))
+        return (indexes + 65).astype(numpy.uint8)
+
+    def _encrypt_indexes(self, indexes: object) -> object:
+        '''Private, encrypts a numpy array of letter indexes and turns the
+        rotors past them. Returns array of encrypted letter indexes'''
+
+        # Rotor positions for every keypress of the message:
+        if self._has_closed_form():
+            left, middle, right = self._rotors
+            presses = numpy.arange(1, len(indexes) + 1)
+            positions = _positions_after(
+                left._position, middle._position, right._position,
+                middle._notches[0], right._notches[0], presses)
+        else:
+            positions = self._positions_array(len(indexes))
+
+        # Tables are converted to numpy once and cached:
+        plugboard = _index_array(tuple(self._plugboard_table))
+        reflector_table = _index_array(self._reflector)
+        wirings = [
+            _wiring_arrays(machine_rotor._rotor_type,
+                           machine_rotor._ring_setting)
+            for machine_rotor in self._rotors
+        ]
+        indexes = plugboard[indexes]
+        for (forward, _), position in zip(reversed(wirings),
+                                          reversed(positions)):
+            indexes = forward[position, indexes]
+        indexes = reflector_table[indexes]
+        for (_, inverse), position in zip(wirings, positions):
+            indexes = inverse[position, indexes]
+        indexes = plugboard[indexes]
+
+        if len(indexes):
+            for machine_rotor, position in zip(self._rotors, positions):
+                machine_rotor._position = int(position[-1])
+        return indexes
+
+    def _positions_array(self, presses: int) -> list:
+        '''Private, returns numpy arrays of positions of every stepping
+        rotor after each of given number of keypresses. Rotor states are
+        stepped until they repeat, the cycle is then repeated by numpy'''
+
+        if self._next_state is not None:
+            step = self._next_state.__getitem__
+        else:
+            step = self._step_state
+        first_press = {}
+        states = []
+        state = self._state_index()
+        while len(states) < presses:
+            state = step(state)
+            if state in first_press:
+                break
+            first_press[state] = len(states)
+            states.append(state)
+
+        press_numbers = numpy.arange(presses)
+        if len(states) < presses:
+            cycle_start = first_press[state]
+            cycle_length = len(states) - cycle_start
+            press_numbers = numpy.where(
+                press_numbers < cycle_start, press_numbers,
+                cycle_start + (press_numbers - cycle_start) % cycle_length)
+        states = numpy.array(states, dtype=numpy.intp)[press_numbers]
+        return [
+            states // 26 ** power % 26
+            for power in reversed(range(len(self._rotors)))
+        ]
+
+    def encrypt_bytes(self, data: bytes, group: bool = True) -> bytes:
+        '''Encrypts ASCII letters given as bytes, result is identical
+        to encoded result of encrypt. Uses numpy if available'''
+
+        if not group:
+            return self._encrypt_bytes_chunk(data, None)[0]
+        return self._encrypt_bytes_chunk(data, 0)[0]
+
+    def encrypt_into(self, source: object, target: object,
+                     group: bool = True) -> int:
+        '''Encrypts ASCII letters of a buffer (bytes, bytearray,
+        memoryview, ...) into a writable buffer, without converting to
+        strings. Returns the number of bytes written. Raises ValueError and
+        leaves the machine unchanged if target buffer is too small'''
+
+        source = memoryview(source).cast('B')
+        target = memoryview(target).cast('B')
+        if target.readonly:
+            raise TypeError('Target buffer must be writable')
+
+        # Short buffers are encrypted key by key, numpy setup would cost
+        # more than the encryption itself:
+        if numpy is None or len(source) < into_array_size:
+            letters = bytes(source).translate(None, mmap_whitespace)
+        else:
+            indexes = _letter_indexes(numpy.frombuffer(source, numpy.uint8))
+            letters = None
+        count = len(indexes) if letters is None else len(letters)
+        length = count + count // 5 if group else count
+        if length > len(target):
+            raise ValueError('Target buffer too small')
+
+        if letters is not None:
+            self._encrypt_into_keys(letters, target, group)
+            return length
+
+        # Encrypted letters are written straight into the target buffer:
+        indexes = self._encrypt_indexes(indexes)
+        output = numpy.frombuffer(target, numpy.uint8)[:length]
+        groups = count // 5 if group else 0
+        grouped = output[:groups * 6].reshape(groups, 6)
+        numpy.add(indexes[:groups * 5].reshape(groups, 5), 65,
+                  out=grouped[:, :5], casting='unsafe')
+        grouped[:, 5] = 32
+        numpy.add(indexes[groups * 5:], 65, out=output[groups * 6:],
+                  casting='unsafe')
+        return length
+
+    def _encrypt_into_keys(self, letters: bytes, target: object,
+                           group: bool) -> None:
+        '''Private, encrypt_into of short buffers. Letters are without
+        whitespace, target is a memoryview long enough for the result.
+        Rotors are left unchanged if a character cannot be encrypted'''
+
+        snapshot = self.snapshot()
+        encrypt_index = self._encrypt_function()
+        position = 0
+        try:
+            for char in letters.decode('latin-1'):
+                if char not in letter_index:
+                    raise Enigma_Error(f'Invalid character to encypt {char}')
+                target[position] = encrypt_index(letter_index[char]) + 65
+                position += 1
+                if group and position % 6 == 5:
+                    target[position] = 32
+                    position += 1
+        except Enigma_Error:
+            self.restore(snapshot)
+            raise
+
+    def _encrypt_bytes_chunk(self, data: bytes, separator: int) -> tuple:
+        '''Private, bytes counterpart of _encrypt_chunk. Separator None
+        turns off grouping. Returns encrypted bytes and next separator'''
+
+        if numpy is None:
+            encrypted_message, next_separator = self._encrypt_chunk(
+                bytes(data).decode('ascii'), separator or 0)
+            if separator is None:
+                encrypted_message = encrypted_message.replace(' ', '')
+            return encrypted_message.encode('ascii'), next_separator
+
+        letters = self.encrypt_array(numpy.frombuffer(data, numpy.uint8))
+        if separator is None:
+            return letters.tobytes(), None
+        letters, separator = _group_array(letters, separator)
+        return letters.tobytes(), separator
+
+    def _update_plugboard_table(self) -> None:
+        '''Private, rebuilds the letter index table of the plugboard,
+        must be called after every plugboard modification'''
+
+        self._plugboard_table = list(range(26))
+        for key, value in self._plugboard.items():
+            if key in alphabet:
+                self._plugboard_table[letter_index[key]] = letter_index[value]
+        if self._permutations is not None:
+            self._permutations = [None] * len(self._permutations)
+
+    # State:
+
+    def snapshot(self) -> tuple:
+        '''Returns positions of stepping rotors as a tuple of letter
+        indexes'''
+
+        return tuple([machine_rotor._position
+                      for machine_rotor in self._rotors])
+
+    def restore(self, snapshot: tuple) -> None:
+        '''Sets rotor positions back to a snapshot'''
+
+        for machine_rotor, position in zip(self._rotors, snapshot):
+            machine_rotor._position = position
+
+    def clone(self) -> object:
+        '''Returns an independent copy of the machine. Only stepping rotors
+        are copied, wiring, fixed rotors, plugboard, settings and compiled
+        tables are shared with the original: they are never modified in
+        place, plugboard methods replace them (copy on write)'''
+
+        copy = Enigma.__new__(Enigma)
+        copy._rotors = [rotor._copy() for rotor in self._rotors]
+        copy._fixed_rotors = self._fixed_rotors
+        copy._reflector = self._reflector
+        copy._plugboard = self._plugboard
+        copy._plugboard_table = self._plugboard_table
+        copy._next_state = self._next_state
+        copy._permutations = self._permutations
+        copy._settings_dict = self._settings_dict
+        copy._stats = None
+        return copy
+
+    # Compiled mode:
+
+    def compile(self, eager: bool = False) -> None:
+        '''Switches the machine to compiled mode, in which every keypress
+        is a rotor state lookup and a single permutation lookup.
+        Permutations are built as states are first reached, or all at once
+        if eager is set. Modifying the plugboard drops built permutations.
+        Tables have 26 ** (number of stepping rotors) states'''
+
+        states = 26 ** len(self._rotors)
+        self._next_state = [
+            self._step_state(state) for state in range(states)
+        ]
+        self._permutations = [None] * states
+        if eager:
+            for state, permutation in self.scrambler_states():
+                self._permutations[state] = permutation
+
+    def is_compiled(self) -> bool:
+        '''True if the machine is in compiled mode'''
+        return self._permutations is not None
+
+    def _state_positions(self, state: int) -> list:
+        '''Private, unpacks a state number into stepping rotor positions,
+        the right rotor is the lowest base 26 digit'''
+
+        positions = []
+        for _ in self._rotors:
+            state, position = divmod(state, 26)
+            positions.append(position)
+        return positions[::-1]
+
+    def _state_index(self) -> int:
+        '''Private, returns rotor positions packed into a single number'''
+
+        state = 0
+        for machine_rotor in self._rotors:
+            state = state * 26 + machine_rotor._position
+        return state
+
+    def _set_state_index(self, state: int) -> None:
+        '''Private, sets rotor positions from a packed state number'''
+
+        for machine_rotor, position in zip(self._rotors,
+                                           self._state_positions(state)):
+            machine_rotor._position = position
+
+    def _step_state(self, state: int) -> int:
+        '''Private, returns the packed state after one turn of the rotors,
+        mirrors the turn method'''
+
+        rotors = self._rotors
+        positions = self._state_positions(state)
+        turned = positions[:]
+        for number in range(1, len(rotors)):
+            if positions[number] in rotors[number]._notches:
+                turned[number - 1] += 1
+                if number < len(rotors) - 1:
+                    turned[number] += 1
+        turned[-1] += 1
+
+        state = 0
+        for position in turned:
+            state = state * 26 + position % 26
+        return state
+
+    def _compile_state(self, state: int) -> list:
+        '''Private, builds the full permutation of letter indexes
+        (plugboard, rotors and reflector) for given packed state'''
+
+        if len(self._rotors) != 3:
+            return self._compile_state_general(state)
+
+        left, middle, right = self._rotors
+        left_position, middle_position = divmod(state // 26, 26)
+        right_position = state % 26
+
+        plugboard = self._plugboard_table
+        reflector_table = self._reflector
+        right_forward = right._forward[right_position]
+        middle_forward = middle._forward[middle_position]
+        left_forward = left._forward[left_position]
+        left_inverse = left._inverse[left_position]
+        middle_inverse = middle._inverse[middle_position]
+        right_inverse = right._inverse[right_position]
+
+        permutation = [
+            plugboard[right_inverse[middle_inverse[left_inverse[
+                reflector_table[left_forward[middle_forward[right_forward[
+                    plugboard[index]]]]]]]]]
+            for index in range(26)
+        ]
+        self._permutations[state] = permutation
+        return permutation
+
+    def _compile_state_general(self, state: int) -> list:
+        '''Private, _compile_state of any number of stepping rotors'''
+
+        permutation = list(range(26))
+        positions = self._state_positions(state)
+        tables = [self._plugboard_table]
+        tables.extend(machine_rotor._forward[position] for machine_rotor,
+                      position in zip(self._rotors[::-1], positions[::-1]))
+        tables.append(self._reflector)
+        tables.extend(machine_rotor._inverse[position] for machine_rotor,
+                      position in zip(self._rotors, positions))
+        tables.append(self._plugboard_table)
+        for table in tables:
+            permutation = [table[index] for index in permutation]
+        self._permutations[state] = permutation
+        return permutation
+
+    def scrambler_states(self) -> object:
+        '''Yields (packed state, permutation of letter indexes) of every
+        rotor state in odometer order, the right rotor turning fastest.
+        Only the right rotor moves within a run of 26 states, so the part
+        of the machine left of it (other rotors, reflector and back) is
+        composed once per run, plugboard is folded into the right rotor
+        tables. Every permutation then takes 3 lookups per letter'''
+
+        *inner_rotors, right = self._rotors
+        plugboard = self._plugboard_table
+        right_forward = [[table[index] for index in plugboard]
+                         for table in right._forward]
+        right_inverse = [[plugboard[index] for index in table]
+                         for table in right._inverse]
+
+        for run in range(26 ** len(inner_rotors)):
+            inner = self._reflector
+            positions = self._state_positions(run * 26)[:-1]
+            for machine_rotor, position in zip(inner_rotors, positions):
+                forward = machine_rotor._forward[position]
+                inverse = machine_rotor._inverse[position]
+                inner = [inverse[inner[index]] for index in forward]
+
+            state = run * 26
+            for forward, inverse in zip(right_forward, right_inverse):
+                yield state, [inverse[inner[index]] for index in forward]
+                state += 1
+
+    def _encrypt_compiled(self, string: str, separator: int) -> tuple:
+        '''Private, _encrypt_chunk method of the compiled mode'''
+
+        next_state = self._next_state
+        permutations = self._permutations
+        state = self._state_index()
+        encrypted_message = []
+
+        try:
+            for char in string:
+                if char in (' ', '\t', '\n'):
+                    continue
+                if char not in letter_index:
+                    raise Enigma_Error(f'Invalid character to encypt {char}')
+
+                state = next_state[state]
+                permutation = permutations[state] or \
+                    self._compile_state(state)
+                encrypted_message.append(
+                    alphabet[permutation[letter_index[char]]])
+                separator += 1
+
+                if separator == 5:
+                    separator = 0
+                    encrypted_message.append(' ')
+        finally:
+            self._set_state_index(state)
+
+        return ''.join(encrypted_message), separator
 
     # Plugboard modifyers:
 
@@ -363,16 +1250,23 @@ class Enigma:
         if letters[1].upper() in self._plugboard.keys():
             raise ValueError('Letter already connected')
 
-        self._plugboard[letters[0]] = letters[1]
-        self._plugboard[letters[1]] = letters[0]
+        # Copied, the dictionary may be shared with clones:
+        plugboard = dict(self._plugboard)
+        plugboard[letters[0]] = letters[1]
+        plugboard[letters[1]] = letters[0]
+        self._plugboard = plugboard
+        self._update_plugboard_table()
 
     def delete_connection(self, letter: str) -> None:
         '''Deletes the connection involving input letter
         doesnt raise any exception if letter not connected'''
 
         if self._plugboard[letter]:
-            self._plugboard.pop(self._plugboard[letter])
-            self._plugboard.pop(letter)
+            plugboard = dict(self._plugboard)
+            plugboard.pop(plugboard[letter])
+            plugboard.pop(letter)
+            self._plugboard = plugboard
+            self._update_plugboard_table()
 
     def new_plugboard(self, pairs: str) -> None:
         '''Creates a new plugboard dict from input'''
@@ -380,6 +1274,7 @@ class Enigma:
             self._plugboard = create_plugboard_dict(pairs)
         except Plugboard_Error:
             raise Plugboard_Error('Invalid input')
+        self._update_plugboard_table()
 
     # Getters:
 
@@ -399,19 +1294,543 @@ class Enigma:
         '''Returns the current position of rotors'''
 
         result = ''
-        for rotor in self._rotors:
+        for rotor in self._fixed_rotors + self._rotors:
             result += rotor.position()
         return result
 
+    def settings(self) -> dict:
+        '''Returns a copy of updated settings dictionary'''
+        settings = dict(self._settings_dict)
+        settings['position'] = self.position()
+        settings['plugboard'] = self.plugboard_string()
+        return settings
+
     # Other:
 
     def save_settings_to_json(self, path: str) -> None:
         '''Updates settings dictionary and dumps it to a json file'''
-        self._settings_dict['position'] = self.position()
-        self._settings_dict['plugboard'] = self.plugboard_string()
+        settings = self.settings()
 
         file_handle = open(path, 'w')
-        json.dump(self._settings_dict, file_handle, indent=4)
+        json.dump(settings, file_handle, indent=4)
+
+
+class CompiledEnigma:
+    '''Immutable compiled key of a machine: next rotor state and full
+    letter permutation (plugboard, rotors and reflector) of every state.
+    Safe to share between threads, positions of independent message
+    streams are kept by lightweight cursors
+        enigma: machine to compile, its current position is the default
+                starting position of cursors
+        tables: optional, already compiled tables of the machine's key,
+                see compiled_tables
+    '''
+    __slots__ = ('_next_state', '_permutations', '_settings', '_fixed')
+
+    def __init__(self, enigma: Enigma, tables: tuple = None):
+        self._next_state, self._permutations = \
+            tables or compiled_tables(enigma)
+        self._settings = enigma.settings()
+        self._fixed = self._settings['position'][:len(enigma._fixed_rotors)]
+
+    def settings(self) -> dict:
+        '''Returns a copy of settings dictionary of the compiled key'''
+        return dict(self._settings)
+
+    def cursor(self, position: str = None) -> object:
+        '''Returns a new cursor at given position (default: position of
+        the compiled machine)'''
+
+        position = (position or self._settings['position']).upper()
+        if not len(position) == len(self._settings['position']):
+            raise ValueError('Invalid input length (position)')
+        if not position.startswith(self._fixed):
+            raise ValueError('Position of fixed rotors cannot change')
+        state = 0
+        for letter in position[len(self._fixed):]:
+            if letter not in alphabet:
+                raise ValueError('Invalid input value (position)')
+            state = state * 26 + alphabet.index(letter)
+        return EnigmaCursor(self, state)
+
+
+def compiled_tables(enigma: Enigma) -> tuple:
+    '''Compiles all rotor states of a machine's key. Returns a tuple of
+    next state of every packed state and the permutations of all states
+    as bytes of letter indexes, 26 per state'''
+
+    machine = enigma.clone()
+    machine.compile(eager=True)
+    return (tuple(machine._next_state),
+            b''.join(map(bytes, machine._permutations)))
+
+
+class EnigmaCursor:
+    '''Position of one message stream on a shared CompiledEnigma,
+    created by CompiledEnigma.cursor. A cursor must not be shared
+    between threads, the compiled machine can'''
+    __slots__ = ('_machine', '_state')
+
+    def __init__(self, machine: CompiledEnigma, state: int):
+        self._machine = machine
+        self._state = state
+
+    def encrypt(self, string: str) -> str:
+        '''Encrypts a message like Enigma.encrypt'''
+        return self._encrypt_chunk(string, 0)[0]
+
+    def encrypt_stream(self, chunks: object) -> object:
+        '''Generator, encrypts chunks like Enigma.encrypt_stream'''
+
+        separator = 0
+        for chunk in chunks:
+            encrypted_chunk, separator = self._encrypt_chunk(chunk, separator)
+            yield encrypted_chunk
+
+    def _encrypt_chunk(self, string: str, separator: int) -> tuple:
+        '''Private, Enigma._encrypt_compiled over the shared tables'''
+
+        next_state = self._machine._next_state
+        permutations = self._machine._permutations
+        state = self._state
+        encrypted_message = bytearray()
+
+        try:
+            for char in string:
+                if char in (' ', '\t', '\n'):
+                    continue
+                if char not in letter_index:
+                    raise Enigma_Error(f'Invalid character to encypt {char}')
+
+                state = next_state[state]
+                encrypted_message.append(
+                    permutations[state * 26 + letter_index[char]])
+                separator += 1
+
+                if separator == 5:
+                    separator = 0
+                    encrypted_message.append(32)
+        finally:
+            self._state = state
+
+        return encrypted_message.translate(index_letters).decode('ascii'), \
+            separator
+
+    def position(self) -> str:
+        '''Returns the current position of rotors'''
+
+        letters = []
+        state = self._state
+        for _ in range(len(self._machine._settings['position']) -
+                       len(self._machine._fixed)):
+            state, position = divmod(state, 26)
+            letters.append(alphabet[position])
+        return self._machine._fixed + ''.join(reversed(letters))
+
+
+class KeySheet:
+    '''Daily settings of a key sheet, read from a json file (list of
+    settings dictionaries or dictionary of them keyed by day) or a jsonl
+    file (one settings dictionary per line). Listed settings name their
+    day with a day key, other keys as written by save_settings_to_json.
+    Machines are built on first use of a day, later uses copy them
+        path:   key sheet file, jsonl if its name ends with .jsonl
+    '''
+    def __init__(self, path: str):
+        with open(path, 'r') as file_handle:
+            if path.endswith('.jsonl'):
+                entries = [json.loads(line) for line in file_handle
+                           if line.strip()]
+            else:
+                entries = json.load(file_handle)
+
+        if type(entries) == dict:
+            entries = [dict(settings, day=day)
+                       for day, settings in entries.items()]
+        self._settings = {}
+        for entry in entries:
+            settings = dict(entry)
+            self._settings[str(settings.pop('day'))] = settings
+        self._machines = {}
+
+    def __len__(self) -> int:
+        return len(self._settings)
+
+    def __contains__(self, day: object) -> bool:
+        return str(day) in self._settings
+
+    def days(self) -> list:
+        '''Returns days of the key sheet in file order'''
+        return list(self._settings)
+
+    def settings(self, day: object) -> dict:
+        '''Returns settings dictionary of a day'''
+
+        if str(day) not in self._settings:
+            raise Enigma_Error(f'No settings for day {day}')
+        return dict(self._settings[str(day)])
+
+    def enigma(self, day: object) -> Enigma:
+        '''Returns a new machine set to the key of a day'''
+
+        machine = self._machines.get(str(day))
+        if machine is None:
+            machine = enigma_from_settings(self.settings(day))
+            self._machines[str(day)] = machine
+        return machine.clone()
+
+
+def _encrypt_segment(settings: dict, segment: str, separator: int) -> str:
+    '''Process pool worker, encrypts a part of a message on a machine
+    built from settings dictionary'''
+
+    enigma = Enigma(settings['rotors'], settings['ring_setting'],
+                    settings['position'], settings['reflector'],
+                    settings['plugboard'])
+    return enigma._encrypt_chunk(segment, separator)[0]
+
+
+def _parallel_encrypt_chunk(enigma: Enigma, data: str, separator: int,
+                            executor: object, workers: int) -> tuple:
+    '''Splits text into a segment per worker, encrypts segments in
+    the executor starting from rotor positions computed by state_at and
+    joins results. Returns encrypted text and the separator after it'''
+
+    settings = enigma.settings()
+    segment_length = -(-len(data) // workers) or 1
+    futures = []
+    letters = 0
+
+    for start in range(0, len(data), segment_length):
+        segment = data[start:start + segment_length]
+        settings['position'] = enigma.state_at(letters)
+        futures.append(executor.submit(
+            _encrypt_segment, dict(settings),
+            segment, (separator + letters) % 5))
+        letters += len(segment) - segment.count(' ') - \
+            segment.count('\t') - segment.count('\n')
+
+    encrypted_message = ''.join(future.result() for future in futures)
+    enigma.seek(letters)
+    return encrypted_message, (separator + letters) % 5
+
+
+def parallel_encrypt(enigma: Enigma, data: str, workers: int = None) -> str:
+    '''Encrypts a message like enigma.encrypt, splitting it between
+    given number of worker processes (default: number of CPUs).
+    Machine is left unchanged if any part of the message is invalid'''
+
+    workers = workers or os.cpu_count()
+    if workers <= 1:
+        return enigma.encrypt(data)
+
+    with ProcessPoolExecutor(workers) as executor:
+        return _parallel_encrypt_chunk(enigma, data, 0, executor, workers)[0]
+
+
+def parallel_encrypt_stream(enigma: Enigma, chunks: object,
+                            workers: int = None) -> object:
+    '''Generator, parallel_encrypt counterpart of Enigma.encrypt_stream'''
+
+    workers = workers or os.cpu_count()
+    separator = 0
+
+    with ProcessPoolExecutor(workers) as executor:
+        for chunk in chunks:
+            encrypted_chunk, separator = _parallel_encrypt_chunk(
+                enigma, chunk, separator, executor, workers)
+            yield encrypted_chunk
+
+
+def scramble_array(rotors: str, reflector_type: str, starts: object,
+                   rings: object, indexes: object) -> object:
+    '''Passes letter indexes through rotors and reflector (no plugboard),
+    requires numpy. Every row of indexes is a message encrypted from its
+    own starting positions and ring settings, given as rows x 3 arrays
+    of letter indexes. Returns array of encrypted letter indexes.
+    Raises ValueError for rotors without closed form stepping (thin or two
+    notch rotors), see _closed_form'''
+
+    _require_closed_form(rotors)
+
+    # Wiring tables of ring setting A are shared by all rows, ring setting
+    # only moves the notch and offsets the rotor position:
+    forward = [numpy.array(_compile_wiring(rotor_type, 'A')[0])
+               for rotor_type in rotors]
+    inverse = [numpy.array(_compile_wiring(rotor_type, 'A')[1])
+               for rotor_type in rotors]
+    notches = [
+        (alphabet.index(rotor[rotor_type]['notch']) - rings[:, number]) % 26
+        for number, rotor_type in enumerate(rotors)
+    ]
+
+    presses = numpy.arange(1, indexes.shape[1] + 1)
+    positions = _positions_after(
+        starts[:, 0:1], starts[:, 1:2], starts[:, 2:3],
+        notches[1][:, None], notches[2][:, None], presses)
+    offsets = [(position - rings[:, number:number + 1]) % 26
+               for number, position in enumerate(positions)]
+    reflector_table = numpy.array(
+        [alphabet.index(letter) for letter in reflector[reflector_type]])
+
+    # Path from the middle rotor through the reflector and back, composed
+    # once for every pair of left and middle rotor offsets:
+    left_offsets = numpy.arange(26)[:, None, None]
+    middle_offsets = numpy.arange(26)[None, :, None]
+    inner = forward[1][middle_offsets, numpy.arange(26)]
+    inner = forward[0][left_offsets, inner]
+    inner = reflector_table[inner]
+    inner = inverse[0][left_offsets, inner]
+    inner = inverse[1][middle_offsets, inner]
+
+    indexes = forward[2][offsets[2], indexes]
+    indexes = inner[offsets[0], offsets[1], indexes]
+    return inverse[2][offsets[2], indexes]
+
+
+def encrypt_batch(jobs: list) -> list:
+    '''Encrypts many messages, each one with its own settings.
+    Jobs are dictionaries with the keys written by save_settings_to_json
+    and a message. Returns a list of (encrypted message, error) tuples in
+    the order of jobs, error is None if the job succeeded.
+    With numpy jobs sharing rotors and reflector are encrypted together,
+    if their stepping has a closed form (see _closed_form)'''
+
+    results = [None] * len(jobs)
+    groups = {}
+
+    for number, job in enumerate(jobs):
+        try:
+            settings = _check_settings(
+                job.get('rotors') or '123', job.get('ring_setting') or 'AAA',
+                job.get('position') or 'AAA', job.get('reflector') or 'A',
+                job.get('plugboard') or '')
+            plugboard = create_plugboard_dict(job.get('plugboard') or '')
+            if not type(job['message']) == str:
+                raise TypeError('Invalid input type (message)')
+        except (TypeError, ValueError, KeyError, IndexError,
+                Plugboard_Error) as error:
+            results[number] = (None, error)
+            continue
+
+        if numpy is None or not _closed_form(settings[0]):
+            try:
+                enigma = Enigma(*settings, job.get('plugboard') or '')
+                results[number] = (enigma.encrypt(job['message']), None)
+            except Enigma_Error as error:
+                results[number] = (None, error)
+            continue
+
+        group = groups.setdefault((settings[0], settings[3]), [])
+        group.append((number, settings, plugboard, job['message']))
+
+    for (rotors, reflector_type), group in groups.items():
+        group.sort(key=lambda item: len(item[3]))
+        for start in range(0, len(group), batch_size):
+            _encrypt_group(rotors, reflector_type,
+                           group[start:start + batch_size], results)
+    return results
+
+
+def _batch_error(error: Exception) -> dict:
+    '''Private, describes a failed batch job by error type and message'''
+    return {'ok': False, 'error': type(error).__name__, 'message': str(error)}
+
+
+def _encrypt_job(job: dict) -> tuple:
+    '''Private, encrypt_batch of a single job, returns (encrypted message,
+    error) even for errors encrypt_batch does not expect'''
+
+    try:
+        return encrypt_batch([job])[0]
+    except Exception as error:
+        return None, error
+
+
+def _run_batch_lines(lines: list) -> list:
+    '''Process pool worker, runs a chunk of batch jobs given as
+    (line number, json line) pairs through encrypt_batch.
+    Returns a result dictionary for every line'''
+
+    results = []
+    jobs = []
+    for line_number, line in lines:
+        result = {'id': line_number}
+        results.append(result)
+        try:
+            job = json.loads(line)
+            if not type(job) == dict:
+                raise TypeError('Job must be a json object')
+            result['id'] = job.get('id', line_number)
+            if 'message' not in job and 'file' in job:
+                with open(job['file'], 'r') as file_handle:
+                    job['message'] = file_handle.read()
+        except (OSError, TypeError, ValueError) as error:
+            result.update(_batch_error(error))
+            continue
+        jobs.append((result, job))
+
+    try:
+        encrypted = encrypt_batch([job for _, job in jobs])
+    except Exception:
+        # A job broke the grouped encryption, jobs are run one by one,
+        # so that only the broken one reports an error:
+        encrypted = [_encrypt_job(job) for _, job in jobs]
+    for (result, _), (message, error) in zip(jobs, encrypted):
+        if error is None:
+            result.update({'ok': True, 'message': message})
+        else:
+            result.update(_batch_error(error))
+    return results
+
+
+def run_batch(lines: object, workers: int = None,
+              jobs_per_task: int = batch_size, ordered: bool = True) -> object:
+    '''Generator, runs jsonl batch jobs in a process pool. Every line of
+    lines is a json object with settings (keys as written by
+    save_settings_to_json) and a message or a file path to encrypt, and
+    an optional id (default: line number). Yields result dictionaries
+    with id, ok and the encrypted message or error type and message.
+    Results come in input order, or as tasks finish if not ordered'''
+
+    workers = workers or os.cpu_count()
+    pending = []
+    chunk = []
+
+    with ProcessPoolExecutor(workers) as executor:
+        for line_number, line in enumerate(lines, 1):
+            if line.strip():
+                chunk.append((line_number, line))
+            if len(chunk) < jobs_per_task:
+                continue
+            pending.append(executor.submit(_run_batch_lines, chunk))
+            chunk = []
+
+            # At most two tasks per worker are waiting for their results:
+            while len(pending) >= 2 * workers:
+                yield from _finished_results(pending, ordered)
+
+        if chunk:
+            pending.append(executor.submit(_run_batch_lines, chunk))
+        while pending:
+            yield from _finished_results(pending, ordered)
+
+
+def _finished_results(pending: list, ordered: bool) -> list:
+    '''Private, waits for the oldest of pending futures (any of them if
+    not ordered), removes finished futures and returns their results'''
+
+    if ordered:
+        return pending.pop(0).result()
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    pending[:] = [future for future in pending if future not in done]
+    return [result for future in done for result in future.result()]
+
+
+def _encrypt_group(rotors: str, reflector_type: str, group: list,
+                   results: list) -> None:
+    '''Private, encrypts jobs sharing rotors and reflector as one
+    jobs x keypresses numpy array and stores encrypted messages
+    in results list'''
+
+    # Messages converted to letter indexes, invalid jobs reported:
+    numbers = []
+    messages = []
+    starts = []
+    rings = []
+    plugboards = []
+    for number, settings, plugboard, message in group:
+        letters = message.replace(' ', '').replace('\t', '')
+        letters = letters.replace('\n', '')
+        if letters.strip(alphabet + alphabet.lower()):
+            char = next(char for char in letters if char not in letter_index)
+            error = Enigma_Error(f'Invalid character to encypt {char}')
+            results[number] = (None, error)
+            continue
+
+        plugboard_table = list(range(26))
+        for key, value in plugboard.items():
+            plugboard_table[alphabet.index(key)] = alphabet.index(value)
+
+        numbers.append(number)
+        letters = letters.upper().encode()
+        messages.append(numpy.frombuffer(letters, numpy.uint8) - 65)
+        starts.append([alphabet.index(letter) for letter in settings[2]])
+        rings.append([alphabet.index(letter) for letter in settings[1]])
+        plugboards.append(plugboard_table)
+
+    if not numbers:
+        return
+
+    # Jobs x keypresses layout, shorter messages padded:
+    lengths = [len(message) for message in messages]
+    indexes = numpy.zeros((len(messages), max(lengths)), dtype=numpy.intp)
+    for row, message in enumerate(messages):
+        indexes[row, :len(message)] = message
+    rows = numpy.arange(len(messages))[:, None]
+    plugboards = numpy.array(plugboards)
+
+    indexes = plugboards[rows, indexes]
+    indexes = scramble_array(rotors, reflector_type, numpy.array(starts),
+                             numpy.array(rings), indexes)
+    indexes = plugboards[rows, indexes]
+
+    letters = (indexes + 65).astype(numpy.uint8)
+    for row, number in enumerate(numbers):
+        encrypted_message = _group_array(letters[row, :lengths[row]])[0]
+        results[number] = (encrypted_message.tobytes().decode(), None)
+
+
+def encrypt_file_mmap(enigma: Enigma, source_path: str, target_path: str,
+                      chunk_size: int = default_chunk_size) -> int:
+    '''Encrypts a text file into another through memory maps of both.
+    A first pass validates the input and counts its letters to pre-size
+    the output file, then chunks of mapped input are encrypted straight
+    into mapped output. Returns the size of the output in bytes'''
+
+    with open(source_path, 'rb') as source, open(target_path, 'w+b') as target:
+        source_size = os.fstat(source.fileno()).st_size
+        if not source_size:
+            return 0
+
+        with mmap.mmap(source.fileno(), 0,
+                       access=mmap.ACCESS_READ) as source_map:
+            letters = 0
+            for start in range(0, source_size, chunk_size):
+                chunk = source_map[start:start + chunk_size]
+                invalid = chunk.translate(None, mmap_whitespace + mmap_letters)
+                if invalid:
+                    char = chr(invalid[0])
+                    raise Enigma_Error(f'Invalid character to encypt {char}')
+                letters += len(chunk.translate(None, mmap_whitespace))
+
+            target_size = letters + letters // 5
+            if not target_size:
+                return 0
+            target.truncate(target_size)
+
+            with mmap.mmap(target.fileno(), target_size) as target_map:
+                separator = 0
+                written = 0
+                for start in range(0, source_size, chunk_size):
+                    encrypted_chunk, separator = enigma._encrypt_bytes_chunk(
+                        source_map[start:start + chunk_size], separator)
+                    end = written + len(encrypted_chunk)
+                    target_map[written:end] = encrypted_chunk
+                    written = end
+                target_map.flush()
+    return target_size
+
+
+def read_chunks(file_handle: object, chunk_size: int) -> object:
+    '''Generator, reads a text file in chunks of given size and
+    closes it when exhausted'''
+
+    with file_handle:
+        chunk = file_handle.read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = file_handle.read(chunk_size)
 
 
 def main():
@@ -422,21 +1841,41 @@ def main():
     parser.add_argument('-message', '-m',
                         help='message to encrypt')
     parser.add_argument('-rotors', '-r',
-                        help='rotors, 3 numbers 1-5')
+                        help='rotors, numbers 1-8, thin B or G first')
     parser.add_argument('-setting', '-s',
-                        help='ring setting, 3 letters A-Z')
+                        help='ring setting, a letter A-Z per rotor')
     parser.add_argument('-position', '-p',
-                        help='starting position, 3 letters A-Z')
+                        help='starting position, a letter A-Z per rotor')
     parser.add_argument('-reflector', '-e',
-                        help='reflector type, 1 letter A-C')
+                        help='reflector type, A-C or thin BT, CT')
     parser.add_argument('-board', '-b',
                         help='plugboard connections, divided by spaces')
     parser.add_argument('-fromfile', '-f',
-                        help='file with message to encode')
+                        help='file with message to encode, - for stdin')
     parser.add_argument('-tofile', '-t',
                         help='file to save resulting message')
     parser.add_argument('-verbosetofile', '-v',
                         help='like tofile but also prints the result')
+    parser.add_argument('-chunksize', '-c', type=int,
+                        help='number of characters read and encrypted '
+                        'at once, default 1M')
+    parser.add_argument('-jobs', '-j', type=int,
+                        help='number of processes encrypting the input')
+    parser.add_argument('-mmap', action='store_true',
+                        help='encrypt fromfile into tofile through '
+                        'memory maps')
+    parser.add_argument('-serve',
+                        help='run encryption service on host:port '
+                        'or unix:path address')
+    parser.add_argument('-batch',
+                        help='jsonl file of jobs (settings with message '
+                        'or file), results go to tofile or stdout')
+    parser.add_argument('-batchsize', type=int, default=batch_size,
+                        help='number of batch jobs sent to a process '
+                        f'at once, default {batch_size}')
+    parser.add_argument('-unordered', action='store_true',
+                        help='write batch results as soon as they are '
+                        'ready instead of in input order')
 
     # Setting up the enigma machine:
     args = parser.parse_args()
@@ -445,30 +1884,63 @@ def main():
     position = args.position or 'AAA'
     reflector = args.reflector or 'A'
     board = args.board or ''
+    chunk_size = args.chunksize or default_chunk_size
     enigma = Enigma(rotors, setting, position, reflector, board)
 
+    # Encryption service, runs until interrupted:
+    if args.serve:
+        from server import serve
+        asyncio.run(serve(args.serve, args.jobs))
+        return
+
+    # Batch of jobs, one json result line for every job line:
+    if args.batch:
+        output = open(args.tofile, 'w') if args.tofile else sys.stdout
+        with open(args.batch, 'r') as file_handle:
+            for result in run_batch(file_handle, args.jobs, args.batchsize,
+                                    not args.unordered):
+                output.write(json.dumps(result) + '\n')
+        if args.tofile:
+            output.close()
+        return
+
+    # Memory mapped encryption of a file into a file:
+    if args.mmap:
+        if not args.fromfile or args.fromfile == '-' or not args.tofile:
+            parser.error('-mmap requires -fromfile and -tofile paths')
+        encrypt_file_mmap(enigma, args.fromfile, args.tofile, chunk_size)
+        return
+
     # Input encryption. Note that text file has priority to terminal input
-    content_table = []
-    if args.fromfile:
-        file_handle = open(args.fromfile, 'r')
-        for line in file_handle:
-            content_table.append(enigma.encrypt(line))
+    if args.fromfile == '-':
+        chunks = read_chunks(sys.stdin, chunk_size)
+    elif args.fromfile:
+        chunks = read_chunks(open(args.fromfile, 'r'), chunk_size)
     elif args.message:
-        content_table = enigma.encrypt(args.message)
+        chunks = [args.message]
+    else:
+        return
+    if args.jobs and args.jobs > 1:
+        encrypted_chunks = parallel_encrypt_stream(enigma, chunks, args.jobs)
+    else:
+        encrypted_chunks = enigma.encrypt_stream(chunks)
 
     # Encrypted message output. Output file has priority over terminal
     if args.tofile:
-        file_handle = open(args.tofile, 'w')
-        for line in content_table:
-            file_handle.write(line)
+        with open(args.tofile, 'w', buffering=chunk_size) as file_handle:
+            for chunk in encrypted_chunks:
+                file_handle.write(chunk)
     elif args.verbosetofile:
-        file_handle = open(args.verbosetofile, 'w')
-        for line in content_table:
-            file_handle.write(line)
-            print(line)
+        with open(args.verbosetofile, 'w',
+                  buffering=chunk_size) as file_handle:
+            for chunk in encrypted_chunks:
+                file_handle.write(chunk)
+                sys.stdout.write(chunk)
+        print()
     else:
-        for line in content_table:
-            print(line)
+        for chunk in encrypted_chunks:
+            sys.stdout.write(chunk)
+        print()
 
 
 if __name__ == "__main__":
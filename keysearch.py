@@ -0,0 +1,243 @@
+from exceptions import Enigma_Error
+from enigma import (alphabet, rotor, reflector, state_count,
+                    create_plugboard_dict, check_rotor_orders,
+                    _compile_wiring)
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import permutations
+from multiprocessing import shared_memory
+import numpy
+import os
+import time
+
+# Wiring tables of the parent process mapped by a worker, see attach_tables:
+_shared_memory = None
+_shared_tables = None
+
+
+def share_tables(rotor_types: str) -> object:
+    '''Copies forward and inverse wiring tables (ring setting A) of rotor
+    types into a new shared memory block, returns the block'''
+
+    memory = shared_memory.SharedMemory(
+        create=True, size=len(rotor_types) * 2 * 26 * 26)
+    tables = numpy.ndarray((len(rotor_types), 2, 26, 26), numpy.uint8,
+                           memory.buf)
+    for number, rotor_type in enumerate(rotor_types):
+        forward, inverse, _ = _compile_wiring(rotor_type, 'A')
+        tables[number, 0] = forward
+        tables[number, 1] = inverse
+    return memory
+
+
+def attach_tables(name: str, rotor_types: str) -> None:
+    '''Process pool initializer, maps wiring tables shared by the parent
+    without copying them'''
+
+    global _shared_memory, _shared_tables
+    _shared_memory = shared_memory.SharedMemory(name=name)
+    tables = numpy.ndarray((len(rotor_types), 2, 26, 26), numpy.uint8,
+                           _shared_memory.buf)
+    _shared_tables = {
+        rotor_type: tables[number]
+        for number, rotor_type in enumerate(rotor_types)
+    }
+
+
+def ensure_tables(rotor_types: str) -> None:
+    '''Maps wiring tables of rotor types for search_rings in a process
+    not started by a pool with the attach_tables initializer'''
+
+    if _shared_tables is not None and \
+            all(rotor_type in _shared_tables for rotor_type in rotor_types):
+        return
+    memory = share_tables(rotor_types)
+    attach_tables(memory.name, rotor_types)
+    memory.close()
+    memory.unlink()
+
+
+def default_rotor_orders() -> list:
+    '''Returns all 60 orders of rotors 1-5'''
+    return [''.join(order) for order in permutations('12345', 3)]
+
+
+def _notch_table(rotor_type: str, ring: int) -> object:
+    '''Returns a boolean array, true at positions where the rotor with
+    given ring setting index is at a notch'''
+
+    notches = [(alphabet.index(notch) - ring) % 26
+               for notch in rotor[rotor_type]['notch']]
+    return numpy.isin(numpy.arange(26), notches)
+
+
+def search_rings(rotors: str, reflector_table: list, middle_ring: int,
+                 plain: list, cipher: list) -> list:
+    '''Process pool worker, tries every right ring setting and starting
+    position of a rotor order with given middle ring setting. Candidates
+    are dropped at the first letter not encrypted to the ciphertext.
+    Returns a list of (right ring, packed starting position) matches'''
+
+    left_tables, middle_tables, right_tables = (
+        _shared_tables[rotor_type] for rotor_type in rotors)
+    reflector_table = numpy.array(reflector_table, dtype=numpy.uint8)
+    middle_notch = _notch_table(rotors[1], middle_ring)
+
+    # Left and middle rotors move rarely, the path from the middle rotor
+    # through the reflector and back is composed once for every pair of
+    # their positions, see Enigma.scrambler_states:
+    left_positions = numpy.arange(26)[:, None, None]
+    middle_offsets = numpy.arange(26)[None, :, None]
+    inner = middle_tables[0][middle_offsets, numpy.arange(26)]
+    inner = left_tables[0][left_positions, inner]
+    inner = reflector_table[inner]
+    inner = left_tables[1][left_positions, inner]
+    inner = middle_tables[1][middle_offsets, inner]
+    starts = numpy.arange(state_count)
+
+    found = []
+    for right_ring in range(26):
+        right_notch = _notch_table(rotors[2], right_ring)
+        survivors = starts
+        left, middle, right = starts // 676, starts // 26 % 26, starts % 26
+
+        for plain_letter, cipher_letter in zip(plain, cipher):
+            # Stepping of Enigma.turn, done for all candidates at once:
+            turn_left = middle_notch[middle]
+            turn_middle = turn_left.astype(numpy.intp) + right_notch[right]
+            left = (left + turn_left) % 26
+            middle = (middle + turn_middle) % 26
+            right = (right + 1) % 26
+
+            middle_offset = (middle - middle_ring) % 26
+            right_offset = (right - right_ring) % 26
+            letters = right_tables[0][right_offset, plain_letter]
+            letters = inner[left, middle_offset, letters]
+            letters = right_tables[1][right_offset, letters]
+
+            matching = letters == cipher_letter
+            survivors = survivors[matching]
+            if not len(survivors):
+                break
+            left = left[matching]
+            middle = middle[matching]
+            right = right[matching]
+
+        found.extend((right_ring, int(state)) for state in survivors)
+    return found
+
+
+def _letters(text: str) -> str:
+    '''Removes whitespace and capitalizes text, raises Enigma_Error
+    for characters out of the alphabet'''
+
+    text = ''.join(text.split()).upper()
+    for letter in text:
+        if letter not in alphabet:
+            raise Enigma_Error(f'Invalid character in text {letter}')
+    return text
+
+
+def prepare_search(ciphertext: str, plaintext: str, reflector_type: str,
+                   plugboard: str) -> tuple:
+    '''Validates search input. Returns plaintext and matching ciphertext
+    letter indexes with known plugboard connections applied, and the
+    reflector table'''
+
+    ciphertext = _letters(ciphertext)
+    plaintext = _letters(plaintext)
+    if not plaintext or len(plaintext) > len(ciphertext):
+        raise Enigma_Error('Plaintext does not fit in the ciphertext')
+    if reflector_type not in reflector:
+        raise Enigma_Error(f'{reflector_type} is not a valid reflector')
+
+    # Known plugboard connections are applied to both texts, so the
+    # search only compares scrambler output:
+    steckers = {
+        alphabet.index(key): alphabet.index(value)
+        for key, value in create_plugboard_dict(plugboard).items()
+    }
+    plain = [steckers.get(alphabet.index(letter), alphabet.index(letter))
+             for letter in plaintext]
+    cipher = [steckers.get(alphabet.index(letter), alphabet.index(letter))
+              for letter in ciphertext[:len(plaintext)]]
+    reflector_table = [alphabet.index(letter)
+                       for letter in reflector[reflector_type]]
+    return plain, cipher, reflector_table
+
+
+def match_arguments(rotors: str, middle_ring: int, right_ring: int,
+                    state: int, reflector_type: str,
+                    plugboard: str) -> tuple:
+    '''Converts a match of search_rings to Enigma constructor arguments'''
+
+    left, state = divmod(state, 676)
+    middle, right = divmod(state, 26)
+    return (rotors, 'A' + alphabet[middle_ring] + alphabet[right_ring],
+            alphabet[left] + alphabet[middle] + alphabet[right],
+            reflector_type, plugboard)
+
+
+def known_plaintext_search(ciphertext: str, plaintext: str,
+                           reflector_type: str = 'B',
+                           rotor_orders: list = None, plugboard: str = '',
+                           workers: int = None,
+                           progress: object = None) -> tuple:
+    '''Searches every rotor order (default: all 60 orders of rotors 1-5),
+    ring setting and starting position for settings encrypting plaintext
+    to the beginning of the ciphertext. Plugboard holds known connections,
+    other letters are taken as unconnected. The left ring setting only
+    moves the left rotor, so it is kept at A.
+    Work is split between worker processes sharing the wiring tables,
+    progress is called with the statistics dictionary after every task.
+    Returns a list of (rotors, ring setting, position, reflector type,
+    plugboard) Enigma constructor arguments and statistics dictionary
+    with number of candidates and candidates/sec'''
+
+    reflector_type = reflector_type.upper()
+    plain, cipher, reflector_table = prepare_search(
+        ciphertext, plaintext, reflector_type, plugboard)
+    rotor_orders = rotor_orders or default_rotor_orders()
+    check_rotor_orders(rotor_orders)
+
+    rotor_types = ''.join(sorted(set(''.join(rotor_orders))))
+    memory = share_tables(rotor_types)
+    statistics = {
+        'tasks': len(rotor_orders) * 26,
+        'tasks_done': 0,
+        'candidates': 0,
+        'seconds': 0.0,
+        'candidates_per_second': 0.0
+    }
+    results = []
+    start_time = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(
+                workers or os.cpu_count(), initializer=attach_tables,
+                initargs=(memory.name, rotor_types)) as executor:
+            futures = {
+                executor.submit(search_rings, rotors, reflector_table,
+                                middle_ring, plain, cipher):
+                (rotors, middle_ring)
+                for rotors in rotor_orders
+                for middle_ring in range(26)
+            }
+            for future in as_completed(futures):
+                rotors, middle_ring = futures[future]
+                results.extend(
+                    match_arguments(rotors, middle_ring, right_ring, state,
+                                    reflector_type, plugboard)
+                    for right_ring, state in future.result())
+
+                statistics['tasks_done'] += 1
+                statistics['candidates'] += 26 * state_count
+                statistics['seconds'] = time.perf_counter() - start_time
+                statistics['candidates_per_second'] = \
+                    statistics['candidates'] / statistics['seconds']
+                if progress is not None:
+                    progress(dict(statistics))
+    finally:
+        memory.close()
+        memory.unlink()
+
+    results.sort()
+    return results, statistics
@@ -0,0 +1,298 @@
+from exceptions import Enigma_Error
+from enigma import alphabet, state_count
+from keysearch import (default_rotor_orders, check_rotor_orders,
+                       prepare_search, match_arguments, search_rings,
+                       share_tables, attach_tables, ensure_tables)
+from concurrent.futures import ProcessPoolExecutor, wait
+import json
+import os
+import socket
+import time
+
+# Seconds after which a unit claimed by another node is handed out again:
+default_claim_timeout = 600
+
+# Seconds between progress reports of the coordinator:
+default_interval = 1.0
+
+
+def _write_json(path: str, data: object) -> None:
+    '''Writes json through a temporary file, so readers never see
+    a partial file'''
+
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as file_handle:
+        json.dump(data, file_handle)
+    os.replace(temporary, path)
+
+
+def _worker_name() -> str:
+    '''Returns name of this process, node (host) name and process id'''
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def _worker_running(worker: str) -> bool:
+    '''True unless worker is a process of this node that has exited'''
+
+    node, _, pid = worker.rpartition('-')
+    if node != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SearchQueue:
+    '''File based work queue of a known-plaintext key search (see
+    keysearch.known_plaintext_search), usable by worker processes of every
+    node that sees its directory. A work unit is a rotor order with a
+    middle ring setting, named like 312-G. Directory layout:
+        job.json                search parameters
+        pending/<unit>          units waiting for a worker
+        claimed/<unit>@<worker> units being searched
+        done/<unit>.json        matches of finished units, the checkpoint
+    Units move between the directories by renaming, which is atomic.
+        directory:  queue directory made by create_search
+    '''
+    def __init__(self, directory: str):
+        self._directory = directory
+        with open(os.path.join(directory, 'job.json'), 'r') as file_handle:
+            self._job = json.load(file_handle)
+
+    def job(self) -> dict:
+        '''Returns a copy of search parameters'''
+        return dict(self._job)
+
+    def units(self) -> list:
+        '''Returns names of all units of the search'''
+
+        return [f'{rotors}-{ring}'
+                for rotors in self._job['rotor_orders'] for ring in alphabet]
+
+    def done(self) -> list:
+        '''Returns names of finished units'''
+
+        return [name[:-5] for name in os.listdir(self._path('done'))
+                if name.endswith('.json')]
+
+    def claim(self, worker: str) -> str:
+        '''Takes a pending unit for worker, returns its name or None if no
+        unit is pending'''
+
+        for unit in sorted(os.listdir(self._path('pending'))):
+            pending = self._path('pending', unit)
+            claimed = self._path('claimed', f'{unit}@{worker}')
+            # The claim time is set before renaming, which keeps it, so
+            # a fresh claim never looks timed out. Units taken by other
+            # workers meanwhile are skipped:
+            try:
+                os.utime(pending)
+                os.rename(pending, claimed)
+            except FileNotFoundError:
+                continue
+            # Requeued by a timeout after its result was written:
+            if os.path.exists(self._path('done', unit + '.json')):
+                self._remove(claimed)
+                continue
+            return unit
+        return None
+
+    def complete(self, unit: str, worker: str, matches: list,
+                 seconds: float) -> None:
+        '''Records matches of a claimed unit as done'''
+
+        _write_json(self._path('done', unit + '.json'), {
+            'unit': unit,
+            'worker': worker,
+            'seconds': seconds,
+            'matches': matches
+        })
+        # The claim is gone if it timed out and was requeued:
+        self._remove(self._path('claimed', f'{unit}@{worker}'))
+
+    def requeue(self, claim_timeout: float = None,
+                exited: bool = False) -> int:
+        '''Hands claimed units back to the queue: with exited, units
+        claimed by workers of this node that are no longer running, and
+        units claimed more than claim_timeout seconds ago.
+        Returns number of units made pending again'''
+
+        done = set(self.done())
+        requeued = 0
+        for name in os.listdir(self._path('claimed')):
+            unit, _, worker = name.partition('@')
+            path = self._path('claimed', name)
+            try:
+                if unit in done:
+                    os.remove(path)
+                    continue
+                age = time.time() - os.stat(path).st_mtime
+                if (exited and not _worker_running(worker)) or \
+                        (claim_timeout is not None and age > claim_timeout):
+                    os.rename(path, self._path('pending', unit))
+                    requeued += 1
+            except FileNotFoundError:
+                continue
+        return requeued
+
+    def results(self) -> list:
+        '''Returns Enigma constructor arguments of all matches found so far,
+        see keysearch.known_plaintext_search'''
+
+        results = []
+        for unit in self.done():
+            with open(self._path('done', unit + '.json'), 'r') as file_handle:
+                matches = json.load(file_handle)['matches']
+            rotors, _, ring = unit.partition('-')
+            results.extend(
+                match_arguments(rotors, alphabet.index(ring), right_ring,
+                                state, self._job['reflector'],
+                                self._job['plugboard'])
+                for right_ring, state in matches)
+        results.sort()
+        return results
+
+    def _path(self, *names) -> str:
+        '''Private, returns path inside the queue directory'''
+        return os.path.join(self._directory, *names)
+
+    def _remove(self, path: str) -> None:
+        '''Private, removes a file another worker may have moved away'''
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def create_search(directory: str, ciphertext: str, plaintext: str,
+                  reflector_type: str = 'B', rotor_orders: list = None,
+                  plugboard: str = '') -> SearchQueue:
+    '''Creates a search queue with every unit pending, or opens the queue
+    of the same search made before, so it can be resumed. Raises
+    Enigma_Error if directory holds a different search'''
+
+    reflector_type = reflector_type.upper()
+    prepare_search(ciphertext, plaintext, reflector_type, plugboard)
+    rotor_orders = rotor_orders or default_rotor_orders()
+    check_rotor_orders(rotor_orders)
+    job = {
+        'ciphertext': ciphertext,
+        'plaintext': plaintext,
+        'reflector': reflector_type,
+        'rotor_orders': list(rotor_orders),
+        'plugboard': plugboard
+    }
+
+    job_path = os.path.join(directory, 'job.json')
+    if os.path.exists(job_path):
+        queue = SearchQueue(directory)
+        if queue.job() != job:
+            raise Enigma_Error(f'{directory} holds another search')
+        return queue
+
+    for name in ('pending', 'claimed', 'done'):
+        os.makedirs(os.path.join(directory, name), exist_ok=True)
+    for rotors in job['rotor_orders']:
+        for ring in alphabet:
+            open(os.path.join(directory, 'pending', f'{rotors}-{ring}'),
+                 'w').close()
+    # Written last, a queue without job file is created again:
+    _write_json(job_path, job)
+    return SearchQueue(directory)
+
+
+def search_worker(directory: str, max_units: int = None) -> int:
+    '''Claims and searches units of a queue until none is pending, or
+    max_units are done. Runs in coordinator processes and can be started
+    on other nodes sharing the directory. Returns number of units done'''
+
+    queue = SearchQueue(directory)
+    job = queue.job()
+    plain, cipher, reflector_table = prepare_search(
+        job['ciphertext'], job['plaintext'], job['reflector'],
+        job['plugboard'])
+    ensure_tables(''.join(sorted(set(''.join(job['rotor_orders'])))))
+    worker = _worker_name()
+
+    units = 0
+    while max_units is None or units < max_units:
+        unit = queue.claim(worker)
+        if unit is None:
+            break
+        rotors, _, ring = unit.partition('-')
+        start_time = time.perf_counter()
+        matches = search_rings(rotors, reflector_table, alphabet.index(ring),
+                               plain, cipher)
+        queue.complete(unit, worker, matches,
+                       time.perf_counter() - start_time)
+        units += 1
+    return units
+
+
+def distributed_search(directory: str, ciphertext: str, plaintext: str,
+                       reflector_type: str = 'B', rotor_orders: list = None,
+                       plugboard: str = '', workers: int = None,
+                       claim_timeout: float = default_claim_timeout,
+                       progress: object = None,
+                       interval: float = default_interval) -> tuple:
+    '''Coordinates a resumable known-plaintext key search through the
+    search queue in directory (see create_search). Units left claimed by
+    workers of this node that exited (an interrupted run), and units
+    claimed for more than claim_timeout seconds are searched again,
+    finished units never are. Runs worker processes until all units are done,
+    calling progress with statistics dictionary every interval seconds.
+    Returns Enigma constructor arguments of all matches and statistics
+    with units, candidates and aggregate candidates/sec of all nodes
+    during this run'''
+
+    queue = create_search(directory, ciphertext, plaintext, reflector_type,
+                          rotor_orders, plugboard)
+    queue.requeue(exited=True)
+    rotor_types = ''.join(sorted(set(''.join(queue.job()['rotor_orders']))))
+    workers = workers or os.cpu_count()
+    units = len(queue.units())
+    done_before = len(queue.done())
+    start_time = time.perf_counter()
+
+    def statistics() -> dict:
+        done = len(queue.done())
+        seconds = time.perf_counter() - start_time
+        searched = (done - done_before) * 26 * state_count
+        return {
+            'units': units,
+            'units_done': done,
+            'candidates': done * 26 * state_count,
+            'seconds': seconds,
+            'candidates_per_second': searched / seconds if seconds else 0.0
+        }
+
+    memory = share_tables(rotor_types)
+    try:
+        with ProcessPoolExecutor(
+                workers, initializer=attach_tables,
+                initargs=(memory.name, rotor_types)) as executor:
+            while len(queue.done()) < units:
+                futures = [executor.submit(search_worker, directory)
+                           for _ in range(workers)]
+                while futures:
+                    finished, futures = wait(futures, timeout=interval)
+                    for future in finished:
+                        future.result()
+                    if progress is not None:
+                        progress(statistics())
+
+                # Units still claimed by other workers, taken back once
+                # their claims time out or their process exits:
+                if len(queue.done()) < units:
+                    time.sleep(interval)
+                    queue.requeue(claim_timeout, exited=True)
+    finally:
+        memory.close()
+        memory.unlink()
+
+    return queue.results(), statistics()
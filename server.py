@@ -0,0 +1,127 @@
+from exceptions import Rotor_Error, Plugboard_Error, Enigma_Error
+from enigma import enigma_from_settings, _encrypt_segment
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import json
+
+# Messages at least this long are encrypted in a worker process:
+default_offload_size = 2 ** 16
+
+# Longest accepted request line in bytes:
+line_limit = 2 ** 26
+
+
+class EnigmaServer:
+    '''Asyncio encryption service speaking line delimited json.
+    Every request is a json object with an op key:
+        open:       settings (keys as written by save_settings_to_json),
+                    returns a session number
+        encrypt:    session, message; returns encrypted message and
+                    position, machine position persists between messages
+        settings:   session; returns current settings of the session
+        close:      session
+    Sessions belong to the connection that opened them. Requests of a
+    connection are answered in order, the next line is read only after
+    the answer is written, which gives backpressure to fast clients.
+        workers:        number of processes encrypting long messages
+        offload_size:   message length from which workers are used
+    '''
+    def __init__(self, workers: int = None,
+                 offload_size: int = default_offload_size):
+        self._workers = workers
+        self._offload_size = offload_size
+        self._executor = None
+
+    async def start(self, address: str) -> object:
+        '''Starts listening on host:port or unix:path address,
+        returns asyncio server object'''
+
+        if address.startswith('unix:'):
+            return await asyncio.start_unix_server(
+                self.handle, address[5:], limit=line_limit)
+        host, _, port = address.rpartition(':')
+        return await asyncio.start_server(
+            self.handle, host or None, int(port), limit=line_limit)
+
+    def close(self) -> None:
+        '''Shuts down worker processes'''
+
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    async def handle(self, reader: object, writer: object) -> None:
+        '''Serves requests of a single connection'''
+
+        sessions = {}
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self._respond(line, sessions)
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, line: bytes, sessions: dict) -> dict:
+        '''Private, returns response to a request line, errors are
+        reported as error type and message'''
+
+        try:
+            request = json.loads(line)
+            operation = request['op']
+            if operation == 'open':
+                enigma = enigma_from_settings(request['settings'])
+                number = max(sessions, default=0) + 1
+                sessions[number] = enigma
+                return {'ok': True, 'session': number}
+
+            enigma = sessions[request['session']]
+            if operation == 'encrypt':
+                message = await self._encrypt(enigma, request['message'])
+                return {'ok': True, 'message': message,
+                        'position': enigma.position()}
+            if operation == 'settings':
+                return {'ok': True, 'settings': enigma.settings()}
+            if operation == 'close':
+                del sessions[request['session']]
+                return {'ok': True}
+            raise ValueError(f'Unknown operation {operation}')
+        except (Rotor_Error, Plugboard_Error, Enigma_Error, TypeError,
+                ValueError, KeyError, IndexError) as error:
+            return {'ok': False, 'error': type(error).__name__,
+                    'message': str(error)}
+
+    async def _encrypt(self, enigma: object, message: str) -> str:
+        '''Private, encrypts a message of a session, long messages are
+        encrypted in a worker process while other sessions are served'''
+
+        if not type(message) == str:
+            raise TypeError('Invalid input type (message)')
+        if len(message) < self._offload_size:
+            return enigma.encrypt(message)
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self._workers)
+        loop = asyncio.get_running_loop()
+        encrypted_message = await loop.run_in_executor(
+            self._executor, _encrypt_segment, enigma.settings(), message, 0)
+        enigma.seek(len(message) - message.count(' ') -
+                    message.count('\t') - message.count('\n'))
+        return encrypted_message
+
+
+async def serve(address: str, workers: int = None) -> None:
+    '''Runs the encryption service until cancelled'''
+
+    enigma_server = EnigmaServer(workers)
+    server = await enigma_server.start(address)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        enigma_server.close()
@@ -0,0 +1,151 @@
+from enigma import alphabet, Enigma, CompiledEnigma, compiled_tables
+from array import array
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+
+# Version of the table file layout, files of other versions are rebuilt:
+table_cache_version = 1
+
+# Default size cap of a cache directory in bytes:
+default_max_bytes = 2 ** 30
+
+# File header: magic, version, byte order of next states (0 little,
+# 1 big endian) and number of rotor states. Next states (4 byte unsigned
+# integers) and permutations (26 letter index bytes per state) follow:
+table_magic = b'ENIGTABL'
+table_header = struct.Struct('<8sHBxI')
+
+
+class TableCache:
+    '''On-disk cache of compiled key tables (see compiled_tables), one
+    versioned binary file per key, named by a hash of the key settings.
+    Files are memory mapped, so processes using the same key share its
+    pages through the page cache. When files grow over max_bytes, the
+    least recently used are removed
+        directory:  cache directory, created if missing
+        max_bytes:  size cap of the cache files, default 1 GB
+    '''
+    def __init__(self, directory: str, max_bytes: int = default_max_bytes):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, enigma: Enigma) -> str:
+        '''Returns hash of the settings the tables of a machine depend on:
+        its settings dictionary without starting position of stepping
+        rotors, plugboard written in letter order'''
+
+        settings = enigma.settings()
+        settings['position'] = \
+            settings['position'][:len(enigma._fixed_rotors)]
+        settings['plugboard'] = ' '.join(
+            alphabet[letter] + alphabet[partner]
+            for letter, partner in enumerate(enigma._plugboard_table)
+            if letter < partner
+        )
+        settings['version'] = table_cache_version
+        text = json.dumps(settings, sort_keys=True).encode('ascii')
+        return hashlib.sha256(text).hexdigest()
+
+    def path(self, enigma: Enigma) -> str:
+        '''Returns path of the table file of a machine's key'''
+        return os.path.join(self._directory, self.key(enigma) + '.tables')
+
+    def tables(self, enigma: Enigma) -> tuple:
+        '''Returns compiled tables of a machine's key as memory mapped
+        (next states, permutations) views. Tables missing in the cache
+        are compiled and stored first'''
+
+        path = self.path(enigma)
+        tables = self._load(path)
+        if tables is None:
+            self._store(path, compiled_tables(enigma))
+            tables = self._load(path)
+        return tables
+
+    def compiled(self, enigma: Enigma) -> CompiledEnigma:
+        '''Returns CompiledEnigma of a machine using cached tables'''
+        return CompiledEnigma(enigma, self.tables(enigma))
+
+    def size(self) -> int:
+        '''Returns total size of the cache files in bytes'''
+        return sum(size for _, size, _ in self._files())
+
+    def _load(self, path: str) -> tuple:
+        '''Private, maps a table file, marks it as recently used.
+        Returns None if the file is missing or of another version'''
+
+        try:
+            with open(path, 'rb') as file_handle:
+                mapped = mmap.mmap(file_handle.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if len(mapped) < table_header.size:
+            mapped.close()
+            return None
+        magic, version, byte_order, states = \
+            table_header.unpack_from(mapped)
+        if magic != table_magic or version != table_cache_version or \
+                byte_order != (sys.byteorder == 'big') or \
+                len(mapped) != table_header.size + 30 * states:
+            mapped.close()
+            return None
+
+        os.utime(path)
+        view = memoryview(mapped)
+        end = table_header.size + 4 * states
+        return (view[table_header.size:end].cast('I'),
+                view[end:end + 26 * states])
+
+    def _store(self, path: str, tables: tuple) -> None:
+        '''Private, writes a table file through a temporary file, so other
+        processes never map a partial file, then evicts old files'''
+
+        next_state, permutations = tables
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as file_handle:
+            file_handle.write(table_header.pack(
+                table_magic, table_cache_version, sys.byteorder == 'big',
+                len(next_state)))
+            file_handle.write(array('I', next_state).tobytes())
+            file_handle.write(permutations)
+        os.replace(temporary, path)
+        self._evict(path)
+
+    def _files(self) -> list:
+        '''Private, returns (path, size, last use) of every table file'''
+
+        files = []
+        for name in os.listdir(self._directory):
+            if not name.endswith('.tables'):
+                continue
+            path = os.path.join(self._directory, name)
+            try:
+                status = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((path, status.st_size, status.st_mtime))
+        return files
+
+    def _evict(self, keep: str) -> None:
+        '''Private, removes least recently used files other than keep
+        until the cache fits in its size cap'''
+
+        files = sorted(self._files(), key=lambda file: file[2])
+        total = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if total <= self._max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
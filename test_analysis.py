@@ -0,0 +1,110 @@
+import pytest
+numpy = pytest.importorskip('numpy')
+from enigma import Enigma, enigma_from_settings  # noqa: E402
+from analysis import (letter_indexes, index_of_coincidence,  # noqa: E402
+                      ngram_table, ngram_score, trial_decrypt,
+                      ciphertext_only_search, PlugboardSearch)
+
+
+sample_text = (
+    'IT WAS THE BEST OF TIMES IT WAS THE WORST OF TIMES IT WAS THE AGE OF '
+    'WISDOM IT WAS THE AGE OF FOOLISHNESS IT WAS THE EPOCH OF BELIEF IT WAS '
+    'THE EPOCH OF INCREDULITY IT WAS THE SEASON OF LIGHT IT WAS THE SEASON '
+    'OF DARKNESS IT WAS THE SPRING OF HOPE IT WAS THE WINTER OF DESPAIR WE '
+    'HAD EVERYTHING BEFORE US WE HAD NOTHING BEFORE US'
+)
+
+
+def test_letter_indexes():
+    assert list(letter_indexes('ab Z')) == [0, 1, 25]
+
+
+def test_letter_indexes_invalid():
+    with pytest.raises(ValueError):
+        letter_indexes('AB1')
+
+
+def test_index_of_coincidence():
+    assert index_of_coincidence(letter_indexes('AAAA'))[0] == 1.0
+    assert index_of_coincidence(letter_indexes('ABCD'))[0] == 0.0
+
+
+def test_ngram_score_prefers_sample_language():
+    table = ngram_table(sample_text)
+    scores = ngram_score(numpy.stack((letter_indexes('THEWORSTOF'),
+                                      letter_indexes('QZXJKVQZXJ'))), table)
+    assert scores[0] > scores[1]
+
+
+def test_trial_decrypt_matches_enigma():
+    ciphertext = Enigma('312', 'AAA', 'QWE', 'B').encrypt(sample_text)
+    state = 16 * 676 + 22 * 26 + 4
+    decrypted = trial_decrypt('312', 'B', 'AAA', [0, state],
+                              letter_indexes(ciphertext))
+    assert (decrypted[1] + 65).astype(numpy.uint8).tobytes() == \
+        sample_text.replace(' ', '').encode()
+
+
+def test_ciphertext_only_search():
+    ciphertext = Enigma('312', 'AFK', 'QWE', 'B').encrypt(sample_text)
+    results = ciphertext_only_search(
+        ciphertext, rotor_orders=['123', '312'], candidates=2,
+        ngrams=ngram_table(sample_text), workers=1)
+    decrypted = enigma_from_settings(results[0]).encrypt(ciphertext)
+    assert decrypted.replace(' ', '') == sample_text.replace(' ', '')
+
+
+def _plugboard_search(plugboard: str) -> PlugboardSearch:
+    settings = {'rotors': '312', 'ring_setting': 'AFK', 'position': 'QWE',
+                'reflector': 'B', 'plugboard': ''}
+    ciphertext = Enigma('312', 'AFK', 'QWE', 'B', plugboard).encrypt(
+        sample_text)
+    return PlugboardSearch(settings, ciphertext, ngram_table(sample_text))
+
+
+def test_plugboard_search_incremental_score():
+    table = ngram_table(sample_text)
+    search = _plugboard_search('AB CD')
+    for first, second in ('AB', 'QW', 'AQ', 'CD', 'AQ'):
+        delta = search.score_swap(first, second)
+        before = search.score()
+        assert search.swap(first, second) == pytest.approx(delta)
+        assert search.score() == pytest.approx(before + delta)
+        full_score = ngram_score(letter_indexes(search.plaintext()), table)
+        assert search.score() == pytest.approx(full_score[0])
+
+
+def test_plugboard_search_hill_climb():
+    search = _plugboard_search('AB CD EF GH IJ')
+    assert search.hill_climb() == 'AB CD EF GH IJ'
+    assert search.plaintext() == sample_text.replace(' ', '')
+
+
+def test_plugboard_search_max_pairs():
+    search = _plugboard_search('AB CD EF GH IJ')
+    assert len(search.hill_climb(max_pairs=2).split()) <= 2
+
+
+@pytest.mark.parametrize('rotors, ring_setting, position, reflector_type', [
+    ('B312', 'AAFK', 'CQWE', 'BT'),
+    ('628', 'AFK', 'QZE', 'B'),
+])
+def test_plugboard_search_thin_and_two_notch_rotors(
+        rotors, ring_setting, position, reflector_type):
+    settings = {'rotors': rotors, 'ring_setting': ring_setting,
+                'position': position, 'reflector': reflector_type,
+                'plugboard': ''}
+    ciphertext = Enigma(rotors, ring_setting, position, reflector_type,
+                        'AB CD EF GH IJ').encrypt(sample_text)
+    search = PlugboardSearch(settings, ciphertext, ngram_table(sample_text))
+    for pair in ('AB', 'CD', 'EF', 'GH', 'IJ'):
+        search.swap(*pair)
+    assert search.plaintext() == sample_text.replace(' ', '')
+
+
+@pytest.mark.parametrize('rotors', ['B12', '612', '1234'])
+def test_trial_decrypt_requires_closed_form(rotors):
+    with pytest.raises(ValueError):
+        trial_decrypt(rotors, 'B', 'AAA', [0], letter_indexes('ABC'))
+    with pytest.raises(ValueError):
+        ciphertext_only_search('ABCDEF', rotor_orders=[rotors], workers=1)
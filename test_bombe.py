@@ -0,0 +1,56 @@
+import pytest
+from enigma import Enigma, enigma_from_settings
+from bombe import create_menu, plugboard_from_steckers, bombe
+from exceptions import Enigma_Error
+
+
+def test_create_menu():
+    menu = create_menu('BDZGO', 'AAAAA')
+    assert menu[0] == (0, 1, 1)
+    assert menu[4] == (0, 14, 5)
+
+
+def test_create_menu_offset():
+    menu = create_menu('XX BDZGO', 'AAA', 2)
+    assert menu[0] == (0, 1, 3)
+
+
+def test_create_menu_self_encryption():
+    with pytest.raises(Enigma_Error):
+        create_menu('BDZGO', 'BAAAA')
+
+
+def test_create_menu_too_long():
+    with pytest.raises(Enigma_Error):
+        create_menu('BDZGO', 'AAAAAA')
+
+
+def test_plugboard_from_steckers():
+    steckers = [-1] * 26
+    steckers[0], steckers[17] = 17, 0
+    steckers[2] = 2
+    assert plugboard_from_steckers(steckers) == 'AR'
+
+
+def test_bombe_finds_settings():
+    plaintext = 'WETTERVORHERSAGEBISKAYAXXDIENSTANORDNUNGEN'
+    enigma = Enigma('241', 'AAA', 'KQD', 'B', 'AR GK OX MZ')
+    ciphertext = enigma.encrypt('QWERTASDFG' + plaintext)
+
+    results, statistics = bombe(ciphertext, plaintext[:24], offset=10,
+                                rotor_orders=['241'], workers=1)
+    assert statistics['positions'] == 26 ** 3
+    assert [settings['position'] for settings in results] == ['KQD']
+
+    decrypting = enigma_from_settings(results[0])
+    assert decrypting.encrypt(ciphertext).replace(' ', '') == \
+        'QWERTASDFG' + plaintext
+
+
+@pytest.mark.parametrize('rotor_order', ['B241', 'B12', '12', '6'])
+def test_bombe_invalid_rotor_order(rotor_order):
+    plaintext = 'WETTERVORHERSAGE'
+    ciphertext = Enigma('241', 'AAA', 'KQD', 'B').encrypt(plaintext)
+    with pytest.raises(Enigma_Error):
+        bombe(ciphertext, plaintext, rotor_orders=['241', rotor_order],
+              workers=1)
@@ -1,7 +1,15 @@
 import pytest
+from itertools import permutations
 from enigma import (shift_char, caesar_shift,
-                    create_plugboard_dict, Rotor, Enigma)
+                    create_plugboard_dict, rotor, Rotor, Enigma,
+                    parallel_encrypt, encrypt_batch, encrypt_file_mmap,
+                    KeySheet, run_batch, CompiledEnigma)
 from exceptions import Rotor_Error, Plugboard_Error, Enigma_Error
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import enigma as enigma_module
+import json
+import tracemalloc
 
 
 def test_rotor_invalid_type():
@@ -155,6 +163,12 @@ def test_plugboard_lowercase():
     assert create_plugboard_dict('ad fh')
 
 
+def test_plugboard_malformed():
+    for string in ('A', 'AB  CD', '1A', 'AB '):
+        with pytest.raises(Plugboard_Error):
+            create_plugboard_dict(string)
+
+
 def test_plugboard_empty():
     assert create_plugboard_dict('') == {}
 
@@ -191,7 +205,7 @@ def test_enigma_init_rotor_length():
 
 def test_enigma_init_rotor_value():
     with pytest.raises(ValueError):
-        Enigma('238')
+        Enigma('239')
 
 
 def test_enigma_init_ring_length():
@@ -261,3 +275,706 @@ def test_enigma_delete_connection():
     enigma.new_plugboard('AB ID KC LW')
     enigma.delete_connection('I')
     assert enigma.plugboard_string() == 'AB KC LW'
+
+
+def test_rotor_liro_reverses_rilo():
+    test_rotor = Rotor('1', 'K', 'F')
+    for letter in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ':
+        assert test_rotor.liro(test_rotor.rilo(letter)) == letter
+
+
+def test_rotor_at_notch():
+    test_rotor = Rotor('1', 'A', 'P')
+    assert not test_rotor.at_notch()
+    test_rotor.turn()
+    assert test_rotor.at_notch()
+    assert test_rotor.turn()
+
+
+def test_enigma_encrypt():
+    enigma = Enigma('123', 'AAA', 'AAA', 'B')
+    assert enigma.encrypt('AAAAA') == 'BDZGO '
+
+
+def test_enigma_decrypt():
+    enigma = Enigma('123', 'AAA', 'AAA', 'B')
+    assert enigma.encrypt('ilbda amtaz') == 'HELLO WORLD '
+
+
+def test_enigma_compiled_matches_interpreted():
+    message = 'THE QUICK BROWN FOX JUMPS OVER THE LAZY DOG' * 30
+    enigma = Enigma('351', 'KDX', 'QEV', 'B', 'AZ BY CX')
+    compiled = Enigma('351', 'KDX', 'QEV', 'B', 'AZ BY CX')
+    compiled.compile()
+    assert compiled.is_compiled()
+    assert compiled.encrypt(message) == enigma.encrypt(message)
+    assert compiled.position() == enigma.position()
+
+
+def test_enigma_compiled_plugboard_change():
+    enigma = Enigma('123', 'AAA', 'AAA', 'B')
+    compiled = Enigma('123', 'AAA', 'AAA', 'B')
+    compiled.compile(eager=True)
+    compiled.encrypt('AAAAA')
+    enigma.encrypt('AAAAA')
+    compiled.add_connection('AB')
+    enigma.add_connection('AB')
+    assert compiled.encrypt('AAAAA') == enigma.encrypt('AAAAA')
+
+
+@pytest.mark.parametrize('settings', [
+    ('351', 'KDX', 'QEV', 'B', 'AZ BY CX'),
+    ('B426', 'AQRS', 'CMNO', 'BT', 'QW ER'),
+    ('7', 'C', 'A', 'C', 'AB'),
+])
+def test_enigma_scrambler_states(settings):
+    enigma = Enigma(*settings)
+    states = list(enigma.scrambler_states())
+    assert [state for state, _ in states] == \
+        list(range(26 ** len(enigma._rotors)))
+
+    enigma.compile()
+    for state, permutation in states[::97]:
+        assert permutation == enigma._compile_state(state)
+
+
+def test_enigma_encrypt_bytes():
+    message = 'The quick brown fox jumps over the lazy dog\n' * 20
+    enigma = Enigma('452', 'XYZ', 'PEV', 'C', 'QW ER')
+    bulk = Enigma('452', 'XYZ', 'PEV', 'C', 'QW ER')
+    assert bulk.encrypt_bytes(message.encode()) == \
+        enigma.encrypt(message).encode()
+    assert bulk.position() == enigma.position()
+
+
+def test_enigma_encrypt_bytes_ungrouped():
+    enigma = Enigma('123', 'AAA', 'AAA', 'B')
+    assert enigma.encrypt_bytes(b'AAAAAAA', group=False) == b'BDZGOWC'
+
+
+def test_enigma_encrypt_array():
+    numpy = pytest.importorskip('numpy')
+    enigma = Enigma('123', 'AAA', 'AAA', 'B')
+    letters = numpy.frombuffer(b'AAAAA', dtype=numpy.uint8)
+    assert enigma.encrypt_array(letters).tobytes() == b'BDZGO'
+    assert enigma.position() == 'AAF'
+
+
+def test_enigma_encrypt_array_tables_cached():
+    numpy = pytest.importorskip('numpy')
+    enigma = Enigma('123', 'AAA', 'AAA', 'B', 'AB')
+    letters = numpy.frombuffer(b'AAAAA', dtype=numpy.uint8)
+    enigma.encrypt_array(letters)
+    misses = enigma_module._wiring_arrays.cache_info().misses
+    enigma.encrypt_array(letters)
+    assert enigma_module._wiring_arrays.cache_info().misses == misses
+    forward, _ = enigma_module._wiring_arrays('1', 'A')
+    assert not forward.flags.writeable
+
+
+def test_enigma_encrypt_array_invalid_char():
+    numpy = pytest.importorskip('numpy')
+    enigma = Enigma()
+    with pytest.raises(Enigma_Error):
+        enigma.encrypt_array(numpy.frombuffer(b'AB!', dtype=numpy.uint8))
+
+
+def test_enigma_encrypt_stream_grouping():
+    message = 'THEQUICKBROWNFOXJUMPSOVERTHELAZYDOG'
+    enigma = Enigma('241', 'QWE', 'RTY', 'B', 'MN')
+    stream = Enigma('241', 'QWE', 'RTY', 'B', 'MN')
+    chunks = [message[index:index + 3] for index in range(0, 35, 3)]
+    assert ''.join(stream.encrypt_stream(chunks)) == enigma.encrypt(message)
+
+
+def test_enigma_encrypt_stream_compiled():
+    message = 'THE QUICK BROWN FOX JUMPS OVER THE LAZY DOG\n' * 10
+    enigma = Enigma('241', 'QWE', 'RTY', 'B', 'MN')
+    stream = Enigma('241', 'QWE', 'RTY', 'B', 'MN')
+    stream.compile()
+    chunks = message.split('\n')
+    assert ''.join(stream.encrypt_stream(chunks)) == enigma.encrypt(message)
+
+
+def test_enigma_state_at_matches_turn():
+    alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    for rotors in permutations('12345', 3):
+        rotors = ''.join(rotors)
+        middle_notch = rotor[rotors[1]]['notch']
+        right_notch = rotor[rotors[2]]['notch']
+        before_notch = alphabet[alphabet.index(middle_notch) - 1]
+        for middle in (middle_notch, before_notch):
+            for right in (right_notch, 'A'):
+                start = 'C' + middle + right
+                enigma = Enigma(rotors, 'AAA', start)
+                jumping = Enigma(rotors, 'AAA', start)
+                for presses in range(700):
+                    assert jumping.state_at(presses) == enigma.position()
+                    enigma.turn()
+
+
+def test_enigma_seek():
+    enigma = Enigma('321', 'BCD', 'QEV', 'B')
+    reference = Enigma('321', 'BCD', 'QEV', 'B')
+    reference.encrypt('A' * 1000)
+    enigma.seek(1000)
+    assert enigma.position() == reference.position()
+    assert enigma.encrypt('HELLO') == reference.encrypt('HELLO')
+
+
+def test_enigma_seek_negative():
+    with pytest.raises(ValueError):
+        Enigma().seek(-1)
+
+
+def test_parallel_encrypt_matches_serial():
+    message = 'The quick brown fox jumps over the lazy dog\n' * 50
+    enigma = Enigma('514', 'GHJ', 'DEV', 'B', 'PO IU')
+    parallel = Enigma('514', 'GHJ', 'DEV', 'B', 'PO IU')
+    assert parallel_encrypt(parallel, message, workers=3) == \
+        enigma.encrypt(message)
+    assert parallel.position() == enigma.position()
+
+
+def test_parallel_encrypt_invalid_char():
+    enigma = Enigma()
+    with pytest.raises(Enigma_Error):
+        parallel_encrypt(enigma, 'ABCDEF' * 10 + '!', workers=2)
+    assert enigma.position() == 'AAA'
+
+
+def test_encrypt_batch():
+    jobs = [
+        {'rotors': '123', 'ring_setting': 'AAA', 'position': 'AAA',
+         'reflector': 'B', 'plugboard': '', 'message': 'AAAAA'},
+        {'rotors': '254', 'ring_setting': 'KLM', 'position': 'QEV',
+         'reflector': 'C', 'plugboard': 'AB CD', 'message': 'Hello world'},
+        {'rotors': '123', 'ring_setting': 'XYZ', 'position': 'ADU',
+         'reflector': 'B', 'plugboard': 'QW', 'message': 'ABC DEF'},
+    ]
+    results = encrypt_batch(jobs)
+    assert results[0] == ('BDZGO ', None)
+    for job, (encrypted_message, error) in zip(jobs, results):
+        enigma = Enigma(job['rotors'], job['ring_setting'], job['position'],
+                        job['reflector'], job['plugboard'])
+        assert encrypted_message == enigma.encrypt(job['message'])
+        assert error is None
+
+
+def test_encrypt_batch_errors():
+    results = encrypt_batch([
+        {'rotors': '129', 'message': 'ABC'},
+        {'plugboard': 'AA', 'message': 'ABC'},
+        {'message': 'ABC!'},
+        {'rotors': '123'},
+        {'plugboard': 'A', 'message': 'ABC'},
+        {'plugboard': 'AB  CD', 'message': 'ABC'},
+        {'plugboard': '1A', 'message': 'ABC'},
+        {'rotors': '123', 'reflector': 'B', 'message': 'AAAAA'},
+    ])
+    assert [type(error) for _, error in results] == \
+        [ValueError, Plugboard_Error, Enigma_Error, KeyError,
+         Plugboard_Error, Plugboard_Error, Plugboard_Error, type(None)]
+    assert all(message is None for message, _ in results[:-1])
+    assert results[-1][0] == 'BDZGO '
+
+
+def test_enigma_profile_counts():
+    enigma = Enigma('123', 'AAA', 'ADU', 'B', 'AB')
+    reference = Enigma('123', 'AAA', 'ADU', 'B', 'AB')
+    with enigma.profile(sample_rate=2) as stats:
+        assert enigma.encrypt('AAAA') == reference.encrypt('AAAA')
+    assert stats.keypresses == 4
+    assert stats.double_steps == 1
+    assert stats.rotor_turns == 4 + 1 + 2
+    assert stats.plugboard_hits >= 4
+    assert stats.samples == 2
+    assert set(stats.estimated_seconds()) == \
+        {'stepping', 'plugboard', 'rotors', 'reflector'}
+
+
+def test_enigma_profile_restores_compiled_mode():
+    enigma = Enigma()
+    enigma.compile()
+    with enigma.profile():
+        assert not enigma.is_compiled()
+        enigma.encrypt('ABC')
+    assert enigma.is_compiled()
+    assert enigma.encrypt('ABC') == Enigma('123', 'AAA', 'AAD').encrypt('ABC')
+
+
+def test_encrypt_file_mmap(tmp_path):
+    message = 'The quick brown fox\njumps over the lazy dog\n' * 100
+    source = tmp_path / 'message.txt'
+    target = tmp_path / 'encrypted.txt'
+    source.write_text(message)
+    enigma = Enigma('153', 'ZXC', 'VBN', 'B', 'AS DF')
+    size = encrypt_file_mmap(enigma, str(source), str(target), 97)
+    expected = Enigma('153', 'ZXC', 'VBN', 'B', 'AS DF').encrypt(message)
+    assert target.read_text() == expected
+    assert size == len(expected)
+
+
+def test_encrypt_file_mmap_invalid_char(tmp_path):
+    source = tmp_path / 'message.txt'
+    source.write_text('ABC!')
+    with pytest.raises(Enigma_Error):
+        encrypt_file_mmap(Enigma(), str(source), str(tmp_path / 'out.txt'))
+
+
+def test_enigma_snapshot_restore():
+    enigma = Enigma('123', 'AAA', 'QEV', 'B')
+    snapshot = enigma.snapshot()
+    encrypted_message = enigma.encrypt('HELLOWORLD')
+    enigma.restore(snapshot)
+    assert enigma.position() == 'QEV'
+    assert enigma.encrypt('HELLOWORLD') == encrypted_message
+
+
+def test_enigma_clone_is_independent():
+    enigma = Enigma('123', 'AAA', 'QEV', 'B', 'AB')
+    enigma.compile()
+    clone = enigma.clone()
+    assert clone.encrypt('HELLO') == enigma.encrypt('HELLO')
+    clone.add_connection('CD')
+    clone.encrypt('HELLO')
+    assert enigma.plugboard_string() == 'AB'
+    assert enigma.position() == 'RGA'
+    assert clone._rotors[0]._forward is enigma._rotors[0]._forward
+
+
+def test_enigma_clone_copy_on_write():
+    enigma = Enigma('B123', 'AAAA', 'CAAA', 'BT', 'AB')
+    clone = enigma.clone()
+    assert clone._plugboard_table is enigma._plugboard_table
+    assert clone._settings_dict is enigma._settings_dict
+    enigma.delete_connection('A')
+    enigma.add_connection('XY')
+    assert clone.plugboard_string() == 'AB'
+    assert clone.settings()['plugboard'] == 'AB'
+    assert enigma.settings()['plugboard'] == 'XY'
+    assert clone.encrypt('AAAAA') == \
+        Enigma('B123', 'AAAA', 'CAAA', 'BT', 'AB').encrypt('AAAAA')
+
+
+def test_enigma_slots():
+    with pytest.raises(AttributeError):
+        Enigma().some_attribute = 1
+
+
+def test_enigma_encrypt_into():
+    target = bytearray(16)
+    enigma = Enigma('123', 'AAA', 'AAA', 'B')
+    written = enigma.encrypt_into(memoryview(b'AAAAA AAAA'), target)
+    assert written == 10
+    assert target[:written] == b'BDZGO WCXL'
+    assert enigma.position() == 'AAJ'
+
+
+def test_enigma_encrypt_into_ungrouped():
+    target = bytearray(5)
+    enigma = Enigma('123', 'AAA', 'AAA', 'B')
+    assert enigma.encrypt_into(b'AAAAA', target, group=False) == 5
+    assert target == bytearray(b'BDZGO')
+
+
+@pytest.mark.parametrize('size', [3, 127, 128, 1001])
+@pytest.mark.parametrize('group', [True, False])
+def test_enigma_encrypt_into_matches_encrypt(size, group):
+    message = ('THE QUICK BROWN FOX jumps over the lazy dog\n' * 30)[:size]
+    enigma = Enigma('B628', 'ABCD', 'AXYZ', 'BT', 'QW ER')
+    reference = Enigma('B628', 'ABCD', 'AXYZ', 'BT', 'QW ER')
+    target = bytearray(2 * size)
+    written = enigma.encrypt_into(message.encode('ascii'), target, group)
+    expected = reference.encrypt(message)
+    if not group:
+        expected = expected.replace(' ', '')
+    assert target[:written].decode('ascii') == expected
+    assert enigma.position() == reference.position()
+
+
+@pytest.mark.parametrize('size', [10, 1000])
+def test_enigma_encrypt_into_invalid_char(size):
+    enigma = Enigma('123', 'AAA', 'AAA', 'B')
+    with pytest.raises(Enigma_Error):
+        enigma.encrypt_into(b'A' * size + b'!', bytearray(2 * size))
+    assert enigma.position() == 'AAA'
+
+
+def test_enigma_encrypt_into_too_small():
+    enigma = Enigma('123', 'AAA', 'AAA', 'B')
+    with pytest.raises(ValueError):
+        enigma.encrypt_into(b'AAAAAA', bytearray(5))
+    assert enigma.position() == 'AAA'
+
+
+def test_enigma_encrypt_into_readonly():
+    with pytest.raises(TypeError):
+        Enigma().encrypt_into(b'AAAAA', b'     ')
+
+
+def test_key_sheet_json(tmp_path):
+    path = tmp_path / 'month.json'
+    path.write_text(json.dumps({
+        '1': {'rotors': '123', 'ring_setting': 'AAA', 'position': 'AAA',
+              'reflector': 'B', 'plugboard': ''},
+        '2': {'rotors': '312', 'ring_setting': 'BCD', 'position': 'XYZ',
+              'reflector': 'B', 'plugboard': 'AB CD EF'}
+    }))
+    sheet = KeySheet(str(path))
+    assert len(sheet) == 2
+    assert sheet.days() == ['1', '2']
+    assert 2 in sheet and '3' not in sheet
+    assert sheet.settings(2)['plugboard'] == 'AB CD EF'
+    first = sheet.enigma(1)
+    assert first.encrypt('AAAA') == 'BDZG'
+    assert sheet.enigma('1').encrypt('AAAA') == 'BDZG'
+    expected = Enigma('312', 'BCD', 'XYZ', 'B', 'AB CD EF').encrypt('HELLO')
+    assert sheet.enigma(2).encrypt('HELLO') == expected
+
+
+def test_key_sheet_jsonl(tmp_path):
+    path = tmp_path / 'month.jsonl'
+    path.write_text('\n'.join(json.dumps(
+        {'day': day, 'rotors': '123', 'ring_setting': 'AAA',
+         'position': position, 'reflector': 'B', 'plugboard': ''})
+        for day, position in ((1, 'AAA'), (2, 'ABC'))) + '\n')
+    sheet = KeySheet(str(path))
+    assert sheet.days() == ['1', '2']
+    assert sheet.enigma(2).position() == 'ABC'
+    with pytest.raises(Enigma_Error):
+        sheet.enigma(3)
+
+
+def test_enigma_m4_matches_three_rotors():
+    message = 'The quick brown fox jumps over the lazy dog' * 20
+    for rotors, position in (('123', 'AAA'), ('541', 'QEV')):
+        m4 = Enigma('B' + rotors, 'AAAA', 'A' + position, 'BT', 'AB CD')
+        enigma = Enigma(rotors, 'AAA', position, 'B', 'AB CD')
+        assert m4.encrypt(message) == enigma.encrypt(message)
+        assert m4.position() == 'A' + enigma.position()
+        m4 = Enigma('G' + rotors, 'AAAA', 'A' + position, 'CT')
+        enigma = Enigma(rotors, 'AAA', position, 'C')
+        assert m4.encrypt(message) == enigma.encrypt(message)
+
+
+def test_enigma_two_notch_stepping():
+    enigma = Enigma('678', 'AAA', 'ALZ')
+    positions = []
+    for _ in range(3):
+        enigma.turn()
+        positions.append(enigma.position())
+    assert positions == ['AMA', 'BNB', 'BNC']
+
+
+def test_enigma_general_machines_consistent():
+    message = 'ENIGMAMACHINE' * 250
+    machines = (('678', 'ABC', 'ZMY', 'B'), ('B628', 'QWER', 'AZMZ', 'BT'),
+                ('12345', 'ABCDE', 'QEVJZ', 'C'), ('G7', 'AB', 'CM', 'CT'))
+    for settings in machines:
+        reference = Enigma(*settings, 'AB XY')
+        expected = ''.join(reference.encrypt_char(char) for char in message)
+        enigma = Enigma(*settings, 'AB XY')
+        assert enigma.state_at(len(message)) == reference.position()
+        assert enigma.encrypt(message).replace(' ', '') == expected
+        assert enigma.position() == reference.position()
+        array = Enigma(*settings, 'AB XY')
+        assert array.encrypt_bytes(message.encode(), group=False) == \
+            expected.encode()
+        assert array.position() == reference.position()
+        if len(settings[0]) <= 4:
+            compiled = Enigma(*settings, 'AB XY')
+            compiled.compile()
+            assert compiled.encrypt(message).replace(' ', '') == expected
+
+
+def test_enigma_fixed_rotor_not_leftmost():
+    with pytest.raises(ValueError):
+        Enigma('1B23', 'AAAA', 'AAAA', 'BT')
+    with pytest.raises(ValueError):
+        Enigma('B', 'A', 'A', 'BT')
+
+
+def test_encrypt_batch_m4():
+    job = {'rotors': 'B312', 'ring_setting': 'ABCD', 'position': 'ZXYZ',
+           'reflector': 'BT', 'plugboard': 'AB CD', 'message': 'HELLOWORLD'}
+    expected = Enigma('B312', 'ABCD', 'ZXYZ', 'BT', 'AB CD').encrypt(
+        'HELLOWORLD')
+    assert encrypt_batch([job]) == [(expected, None)]
+
+
+def test_run_batch(tmp_path):
+    source = tmp_path / 'message.txt'
+    source.write_text('HELLO WORLD')
+    settings = {'rotors': '312', 'ring_setting': 'BCD', 'position': 'XYZ',
+                'reflector': 'B', 'plugboard': 'AB CD'}
+    lines = [
+        json.dumps(dict(settings, message='HELLO WORLD')),
+        json.dumps(dict(settings, id='from-file', file=str(source))),
+        json.dumps(dict(settings, plugboard='AA', message='HELLO')),
+        '',
+        'not json',
+        json.dumps(dict(settings, message='HELLO 123')),
+    ]
+    expected = Enigma('312', 'BCD', 'XYZ', 'B', 'AB CD').encrypt('HELLOWORLD')
+
+    results = list(run_batch(lines, workers=2, jobs_per_task=2))
+    assert [result['id'] for result in results] == [1, 'from-file', 3, 5, 6]
+    assert results[0] == {'id': 1, 'ok': True, 'message': expected}
+    assert results[1]['message'] == expected
+    assert results[2]['error'] == 'Plugboard_Error'
+    assert results[3]['error'] == 'JSONDecodeError'
+    assert results[4]['error'] == 'Enigma_Error'
+    assert not any(result['ok'] for result in results[2:])
+
+    unordered = run_batch(lines, workers=2, jobs_per_task=1, ordered=False)
+    assert sorted(map(json.dumps, unordered)) == \
+        sorted(map(json.dumps, results))
+
+
+def test_run_batch_bad_plugboard_line():
+    settings = {'rotors': '312', 'ring_setting': 'BCD', 'position': 'XYZ',
+                'reflector': 'B', 'plugboard': 'AB CD'}
+    lines = [
+        json.dumps(dict(settings, message='HELLO')),
+        json.dumps(dict(settings, plugboard='1A', message='HELLO')),
+        json.dumps(dict(settings, message='WORLD')),
+    ]
+    results = list(run_batch(lines, workers=1))
+    assert [result['ok'] for result in results] == [True, False, True]
+    assert results[1]['error'] == 'Plugboard_Error'
+    assert results[2]['message'] == \
+        Enigma('312', 'BCD', 'XYZ', 'B', 'AB CD').encrypt('WORLD')
+
+
+def test_run_batch_lines_isolates_unexpected_errors(monkeypatch):
+    encrypt_batch = enigma_module.encrypt_batch
+
+    def broken_batch(jobs):
+        if any(job.get('broken') for job in jobs):
+            raise RuntimeError('broken job')
+        return encrypt_batch(jobs)
+
+    monkeypatch.setattr(enigma_module, 'encrypt_batch', broken_batch)
+    results = enigma_module._run_batch_lines([
+        (1, json.dumps({'message': 'AAAAA'})),
+        (2, json.dumps({'message': 'AAAAA', 'broken': True})),
+    ])
+    assert results[0] == {'id': 1, 'ok': True,
+                          'message': Enigma().encrypt('AAAAA')}
+    assert results[1]['ok'] is False
+    assert results[1]['error'] == 'RuntimeError'
+
+
+def test_compiled_enigma_cursors():
+    message = 'The quick brown fox jumps over the lazy dog\n' * 30
+    machine = CompiledEnigma(Enigma('B312', 'ABCD', 'AXYZ', 'BT', 'AB CD'))
+    reference = Enigma('B312', 'ABCD', 'AXYZ', 'BT', 'AB CD')
+    cursor = machine.cursor()
+    assert cursor.encrypt(message) == reference.encrypt(message)
+    assert cursor.position() == reference.position()
+
+    other = machine.cursor('AQEV')
+    reference = Enigma('B312', 'ABCD', 'AQEV', 'BT', 'AB CD')
+    chunks = message.split('\n')
+    assert ''.join(other.encrypt_stream(chunks)) == reference.encrypt(message)
+    assert machine.settings()['position'] == 'AXYZ'
+
+
+def test_compiled_enigma_threads():
+    machine = CompiledEnigma(Enigma('312', 'BCD', 'XYZ', 'B', 'AB CD'))
+    positions = ['AAA', 'QEV', 'ZZZ', 'MNO'] * 4
+    message = 'HELLOWORLD' * 500
+
+    def encrypt(position):
+        return machine.cursor(position).encrypt(message)
+
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(encrypt, positions))
+    for position, encrypted in zip(positions, results):
+        expected = Enigma('312', 'BCD', position, 'B', 'AB CD')
+        assert encrypted == expected.encrypt(message)
+
+
+def test_compiled_enigma_cursor_invalid():
+    machine = CompiledEnigma(Enigma('B123', 'AAAA', 'AAAA', 'BT'))
+    with pytest.raises(ValueError):
+        machine.cursor('AAA')
+    with pytest.raises(ValueError):
+        machine.cursor('BAAA')
+    with pytest.raises(ValueError):
+        machine.cursor('A!AA')
+    with pytest.raises(Enigma_Error):
+        machine.cursor().encrypt('AB1')
+
+
+# Operation counting, used only by the budget tests below:
+class CountingTable:
+    '''Lookup table counting its lookups under a name'''
+    def __init__(self, rows: object, counts: Counter, name: str):
+        self._rows = rows
+        self._counts = counts
+        self._name = name
+
+    def __getitem__(self, index: int) -> object:
+        self._counts[self._name] += 1
+        return self._rows[index]
+
+
+class CountingRotor(Rotor):
+    '''Rotor counting every change of its position'''
+    __slots__ = ('_counted_position', '_counts')
+
+    @property
+    def _position(self) -> int:
+        return self._counted_position
+
+    @_position.setter
+    def _position(self, position: int) -> None:
+        self._counts['rotor_steps'] += 1
+        self._counted_position = position
+
+
+def counting_enigma(*settings) -> tuple:
+    '''Returns a machine with counting wiring tables and rotors,
+    and the counter they share'''
+
+    counts = Counter()
+    machine = Enigma(*settings)
+    rotors = []
+    for original in machine._rotors:
+        counting_rotor = CountingRotor.__new__(CountingRotor)
+        counting_rotor._counts = counts
+        counting_rotor._rotor_type = original._rotor_type
+        counting_rotor._ring_setting = original._ring_setting
+        counting_rotor._counted_position = original._position
+        counting_rotor._notches = original._notches
+        counting_rotor._forward = CountingTable(
+            original._forward, counts, 'wiring_lookups')
+        counting_rotor._inverse = CountingTable(
+            original._inverse, counts, 'wiring_lookups')
+        rotors.append(counting_rotor)
+    machine._rotors = rotors
+    machine._reflector = CountingTable(
+        machine._reflector, counts, 'reflector_lookups')
+    machine._plugboard_table = CountingTable(
+        machine._plugboard_table, counts, 'plugboard_lookups')
+    return machine, counts
+
+
+@pytest.fixture
+def string_rebuilds(monkeypatch):
+    '''Counts calls of the string shifting helpers'''
+
+    counts = Counter()
+
+    def counted(function):
+        def wrapper(*args):
+            counts[function.__name__] += 1
+            return function(*args)
+        return wrapper
+
+    monkeypatch.setattr(enigma_module, 'caesar_shift',
+                        counted(enigma_module.caesar_shift))
+    monkeypatch.setattr(enigma_module, 'shift_char',
+                        counted(enigma_module.shift_char))
+    return counts
+
+
+class CountingLetter(str):
+    '''Output letter counting characters copied by concatenating a string
+    with it, as a naive str += would copy them'''
+
+    def __radd__(self, other: str) -> str:
+        CountingAlphabet.counts['copied_characters'] += len(other) + 1
+        return str.__add__(other, self)
+
+
+class CountingAlphabet(str):
+    '''Alphabet handing out CountingLetter letters'''
+    counts = None
+
+    def __getitem__(self, index: int) -> str:
+        return CountingLetter(str.__getitem__(self, index))
+
+
+@pytest.fixture
+def output_copies(monkeypatch):
+    '''Counts characters copied while building encrypted output'''
+
+    counts = Counter()
+    monkeypatch.setattr(CountingAlphabet, 'counts', counts)
+    monkeypatch.setattr(enigma_module, 'alphabet',
+                        CountingAlphabet(enigma_module.alphabet))
+    return counts
+
+
+def test_budget_encrypt_per_letter(string_rebuilds, output_copies):
+    letters = 10000
+    machine, counts = counting_enigma('312', 'BCD', 'XYZ', 'B', 'AB CD')
+    encrypted = machine.encrypt('HELLOWORLD' * (letters // 10))
+
+    assert len(encrypted) == letters * 6 // 5
+    assert counts['wiring_lookups'] == 6 * letters
+    assert counts['reflector_lookups'] == letters
+    assert counts['plugboard_lookups'] == 2 * letters
+    # Right rotor every letter, middle and left about every 26 letters:
+    assert letters <= counts['rotor_steps'] <= letters * 28 // 26 + 2
+    assert not string_rebuilds
+    # Output is joined once, not concatenated letter by letter:
+    assert output_copies['copied_characters'] <= 2 * letters
+
+
+@pytest.mark.parametrize('compiled', [False, True])
+def test_budget_encrypt_is_linear(output_copies, compiled):
+    work = []
+    for letters in (2000, 20000):
+        machine, counts = counting_enigma('123', 'AAA', 'QEV', 'B')
+        if compiled:
+            machine.compile(eager=True)
+        output_copies.clear()
+        machine.encrypt('A' * letters)
+        work.append(counts['rotor_steps'] +
+                    output_copies['copied_characters'])
+    # Compiled stepping only moves rotors once per chunk:
+    assert work[1] <= 10 * work[0] + 20
+
+
+def test_budget_compiled_lookups_per_state():
+    letters = 50000
+    machine, counts = counting_enigma('312', 'BCD', 'XYZ', 'B', 'AB CD')
+    machine.compile()
+    machine.encrypt('A' * letters)
+
+    # Wiring is only read when a rotor state is reached the first time:
+    built = sum(permutation is not None
+                for permutation in machine._permutations)
+    assert counts['wiring_lookups'] == 6 * built
+    assert counts['reflector_lookups'] == 26 * built
+    assert counts['rotor_steps'] <= 3
+
+
+def test_budget_construction(string_rebuilds):
+    Enigma('312', 'BCD', 'XYZ', 'B', 'AB CD').encrypt('HELLO')
+    Rotor('4', 'Q', 'E').turn()
+    assert not string_rebuilds
+
+
+def test_budget_encrypt_memory():
+    message = 'HELLOWORLD' * 20000
+    machine = Enigma('312', 'BCD', 'XYZ', 'B', 'AB CD')
+    machine.encrypt('HELLO')
+    tracemalloc.start()
+    try:
+        encrypted = machine.encrypt(message)
+        peak = tracemalloc.get_traced_memory()[1]
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(True, enigma_module.__file__)])
+    finally:
+        tracemalloc.stop()
+
+    # A list of letter references (8 bytes each) and the joined result:
+    assert peak < 14 * len(message)
+    # Nothing but the result stays allocated by the encryption:
+    retained = sum(trace.size for trace in snapshot.traces)
+    assert retained < len(encrypted) + 1024
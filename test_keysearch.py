@@ -0,0 +1,57 @@
+import pytest
+numpy = pytest.importorskip('numpy')
+from enigma import Enigma  # noqa: E402
+from exceptions import Enigma_Error  # noqa: E402
+from keysearch import known_plaintext_search  # noqa: E402
+
+
+plaintext = 'WETTERVORHERSAGEBISKAYA'
+
+
+def test_known_plaintext_search_finds_settings():
+    ciphertext = Enigma('312', 'AGK', 'QZV', 'B', 'AB CD').encrypt(
+        plaintext + 'NACHT')
+    reports = []
+    results, statistics = known_plaintext_search(
+        ciphertext, plaintext, 'B', ['312'], plugboard='AB CD', workers=1,
+        progress=reports.append)
+
+    assert ('312', 'AGK', 'QZV', 'B', 'AB CD') in results
+    for arguments in results:
+        decrypted = Enigma(*arguments).encrypt(ciphertext).replace(' ', '')
+        assert decrypted.startswith(plaintext)
+    assert statistics['candidates'] == 26 * 26 * 26 ** 3
+    assert statistics['candidates_per_second'] > 0
+    assert len(reports) == 26
+    assert reports[-1]['tasks_done'] == statistics['tasks']
+
+
+def test_known_plaintext_search_wrong_order():
+    ciphertext = Enigma('312', 'AGK', 'QZV', 'B').encrypt(plaintext)
+    results, _ = known_plaintext_search(ciphertext, plaintext, 'B', ['123'],
+                                        workers=1)
+    assert results == []
+
+
+def test_known_plaintext_search_invalid_text():
+    with pytest.raises(Enigma_Error):
+        known_plaintext_search('ABC', 'ABCD')
+    with pytest.raises(Enigma_Error):
+        known_plaintext_search('ABC1', 'AB')
+
+
+@pytest.mark.parametrize('rotor_order', ['B12', '1234', '19', '12'])
+def test_known_plaintext_search_invalid_rotor_order(rotor_order):
+    with pytest.raises(Enigma_Error):
+        known_plaintext_search('ABCDEF', 'ABC', 'B', ['312', rotor_order],
+                               workers=1)
+
+
+def test_known_plaintext_search_two_notch_rotors():
+    ciphertext = Enigma('627', 'AGK', 'QZL', 'B').encrypt(plaintext)
+    results, _ = known_plaintext_search(ciphertext, plaintext, 'B', ['627'],
+                                        workers=1)
+    assert ('627', 'AGK', 'QZL', 'B', '') in results
+    for arguments in results:
+        decrypted = Enigma(*arguments).encrypt(ciphertext).replace(' ', '')
+        assert decrypted.startswith(plaintext)
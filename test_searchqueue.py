@@ -0,0 +1,102 @@
+import pytest
+numpy = pytest.importorskip('numpy')
+from enigma import Enigma  # noqa: E402
+from exceptions import Enigma_Error  # noqa: E402
+from keysearch import known_plaintext_search  # noqa: E402
+from searchqueue import (SearchQueue, create_search,  # noqa: E402
+                         search_worker, distributed_search)
+import os  # noqa: E402
+import socket  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+
+
+plaintext = 'WETTERVORHERSAGEBISKAYA'
+ciphertext = Enigma('312', 'AGK', 'QZV', 'B', 'AB CD').encrypt(
+    plaintext + 'NACHT')
+
+
+def exited_worker() -> str:
+    '''Returns worker name of a process of this node that has exited'''
+
+    pid = subprocess.run(
+        [sys.executable, '-c', 'import os; print(os.getpid())'],
+        capture_output=True, text=True, check=True).stdout
+    return f'{socket.gethostname()}-{int(pid)}'
+
+
+def test_distributed_search_matches_local_search(tmp_path):
+    reports = []
+    results, statistics = distributed_search(
+        str(tmp_path), ciphertext, plaintext, 'B', ['312'], 'AB CD',
+        workers=1, progress=reports.append, interval=0.05)
+
+    expected, _ = known_plaintext_search(ciphertext, plaintext, 'B',
+                                         ['312'], 'AB CD', workers=1)
+    assert results == expected
+    assert ('312', 'AGK', 'QZV', 'B', 'AB CD') in results
+    assert statistics['units_done'] == statistics['units'] == 26
+    assert statistics['candidates'] == 26 * 26 * 26 ** 3
+    assert statistics['candidates_per_second'] > 0
+    assert reports
+
+
+def test_distributed_search_resumes(tmp_path):
+    directory = str(tmp_path)
+    queue = create_search(directory, ciphertext, plaintext, 'B', ['312'],
+                          'AB CD')
+    assert search_worker(directory, max_units=5) == 5
+
+    # Unit left claimed by a worker of this node that died:
+    unit = queue.claim(exited_worker())
+    assert unit is not None
+    done = os.path.join(directory, 'done')
+    checkpoints = {name: os.stat(os.path.join(done, name)).st_mtime_ns
+                   for name in os.listdir(done)}
+    assert len(checkpoints) == 5
+
+    results, statistics = distributed_search(
+        directory, ciphertext, plaintext, 'B', ['312'], 'AB CD', workers=1,
+        interval=0.05)
+    assert ('312', 'AGK', 'QZV', 'B', 'AB CD') in results
+    assert statistics['units_done'] == 26
+    assert os.listdir(os.path.join(directory, 'claimed')) == []
+    for name, mtime in checkpoints.items():
+        assert os.stat(os.path.join(done, name)).st_mtime_ns == mtime
+
+
+def test_search_queue_requeue_timeout(tmp_path):
+    queue = create_search(str(tmp_path), ciphertext, plaintext, 'B', ['312'])
+    unit = queue.claim('othernode-1')
+    assert queue.requeue(claim_timeout=60) == 0
+    assert queue.requeue(claim_timeout=-1) == 1
+    assert queue.claim('othernode-2') == unit
+
+
+def test_search_queue_keeps_running_workers_claims(tmp_path):
+    queue = create_search(str(tmp_path), ciphertext, plaintext, 'B', ['312'])
+    running = f'{socket.gethostname()}-{os.getpid()}'
+    unit = queue.claim(running)
+    queue.claim(exited_worker())
+    assert queue.requeue(exited=True) == 1
+
+    # A claim requeued while its worker still runs does not break the
+    # worker, and its finished unit is not handed out again:
+    assert queue.requeue(claim_timeout=-1) == 1
+    queue.complete(unit, running, [], 0.0)
+    assert unit in queue.done()
+    claimed = {queue.claim('othernode-1') for _ in range(25)}
+    assert unit not in claimed and None not in claimed
+    assert queue.claim('othernode-1') is None
+
+
+def test_create_search_invalid_rotor_order(tmp_path):
+    with pytest.raises(Enigma_Error):
+        create_search(str(tmp_path), ciphertext, plaintext, 'B', ['B12'])
+
+
+def test_create_search_other_job(tmp_path):
+    create_search(str(tmp_path), ciphertext, plaintext, 'B', ['312'])
+    assert SearchQueue(str(tmp_path)).job()['rotor_orders'] == ['312']
+    with pytest.raises(Enigma_Error):
+        create_search(str(tmp_path), ciphertext, plaintext, 'C', ['312'])
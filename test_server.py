@@ -0,0 +1,69 @@
+import asyncio
+import json
+from enigma import Enigma
+from server import EnigmaServer
+
+
+async def _exchange(server_object, requests):
+    server = await server_object.start('127.0.0.1:0')
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    responses = []
+    for request in requests:
+        writer.write(json.dumps(request).encode() + b'\n')
+        await writer.drain()
+        responses.append(json.loads(await reader.readline()))
+    writer.close()
+    server.close()
+    await server.wait_closed()
+    server_object.close()
+    return responses
+
+
+settings = {'rotors': '123', 'ring_setting': 'AAA', 'position': 'AAA',
+            'reflector': 'B', 'plugboard': ''}
+
+
+def test_server_session_keeps_position():
+    responses = asyncio.run(_exchange(EnigmaServer(), [
+        {'op': 'open', 'settings': settings},
+        {'op': 'encrypt', 'session': 1, 'message': 'AAAAA'},
+        {'op': 'encrypt', 'session': 1, 'message': 'AAAAA'},
+        {'op': 'close', 'session': 1},
+    ]))
+    enigma = Enigma('123', 'AAA', 'AAA', 'B')
+    assert responses[0] == {'ok': True, 'session': 1}
+    assert responses[1]['message'] == enigma.encrypt('AAAAA')
+    assert responses[2]['message'] == enigma.encrypt('AAAAA')
+    assert responses[2]['position'] == enigma.position()
+    assert responses[3] == {'ok': True}
+
+
+def test_server_offloads_long_messages():
+    message = 'HELLOWORLD' * 50
+    responses = asyncio.run(_exchange(EnigmaServer(1, offload_size=100), [
+        {'op': 'open', 'settings': settings},
+        {'op': 'encrypt', 'session': 1, 'message': message},
+        {'op': 'encrypt', 'session': 1, 'message': 'ABC'},
+    ]))
+    enigma = Enigma('123', 'AAA', 'AAA', 'B')
+    assert responses[1]['message'] == enigma.encrypt(message)
+    assert responses[2]['message'] == enigma.encrypt('ABC')
+
+
+def test_server_errors():
+    responses = asyncio.run(_exchange(EnigmaServer(), [
+        {'op': 'open', 'settings': dict(settings, rotors='129')},
+        {'op': 'encrypt', 'session': 7, 'message': 'ABC'},
+        {'op': 'open', 'settings': settings},
+        {'op': 'encrypt', 'session': 1, 'message': 'AB!'},
+        {'op': 'open', 'settings': dict(settings, plugboard='A')},
+        {'op': 'open', 'settings': dict(settings, plugboard='1A')},
+        {'op': 'encrypt', 'session': 1, 'message': 'AAAAA'},
+    ]))
+    assert [response.get('error') for response in responses] == \
+        ['ValueError', 'KeyError', None, 'Enigma_Error', 'Plugboard_Error',
+         'Plugboard_Error', None]
+    # The connection and its session survive a malformed plugboard:
+    assert responses[-1]['ok']
+
@@ -0,0 +1,69 @@
+import os
+import time
+from enigma import Enigma
+from bombe import scrambler_tables
+from tablecache import TableCache, table_header
+
+
+message = 'The quick brown fox jumps over the lazy dog' * 10
+
+
+def test_table_cache_compiled_matches_enigma(tmp_path):
+    cache = TableCache(str(tmp_path))
+    enigma = Enigma('B312', 'ABCD', 'AXYZ', 'BT', 'AB CD')
+    cold = cache.compiled(enigma)
+    warm = TableCache(str(tmp_path)).compiled(enigma)
+    expected = Enigma('B312', 'ABCD', 'AXYZ', 'BT', 'AB CD').encrypt(message)
+    assert cold.cursor().encrypt(message) == expected
+    assert warm.cursor().encrypt(message) == expected
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_table_cache_key(tmp_path):
+    key = TableCache(str(tmp_path)).key
+    enigma = Enigma('312', 'BCD', 'XYZ', 'B', 'AB CD')
+    assert key(enigma) == key(Enigma('312', 'BCD', 'QEV', 'B', 'DC BA'))
+    assert key(enigma) != key(Enigma('312', 'BCE', 'XYZ', 'B', 'AB CD'))
+    assert key(Enigma('B312', 'AAAA', 'AAAA', 'BT')) != \
+        key(Enigma('B312', 'AAAA', 'BAAA', 'BT'))
+
+
+def test_table_cache_rebuilds_invalid_file(tmp_path):
+    cache = TableCache(str(tmp_path))
+    enigma = Enigma('123', 'AAA', 'AAA', 'B')
+    path = cache.path(enigma)
+    with open(path, 'wb') as file_handle:
+        file_handle.write(b'\0' * table_header.size)
+    encrypted = cache.compiled(enigma).cursor().encrypt(message)
+    assert encrypted == Enigma('123', 'AAA', 'AAA', 'B').encrypt(message)
+    assert os.path.getsize(path) > table_header.size
+
+
+def test_table_cache_evicts_least_recently_used(tmp_path):
+    first = Enigma('123', 'AAA', 'AAA', 'B')
+    second = Enigma('231', 'AAA', 'AAA', 'B')
+    third = Enigma('312', 'AAA', 'AAA', 'B')
+    cache = TableCache(str(tmp_path))
+    cache.tables(first)
+    file_size = cache.size()
+
+    cache = TableCache(str(tmp_path), max_bytes=2 * file_size)
+    cache.tables(second)
+    old = time.time() - 100
+    os.utime(cache.path(first), (old, old))
+    os.utime(cache.path(second), (old - 100, old - 100))
+    cache.tables(first)
+    cache.tables(third)
+    assert os.path.exists(cache.path(first))
+    assert not os.path.exists(cache.path(second))
+    assert os.path.exists(cache.path(third))
+    assert cache.size() <= 2 * file_size
+
+
+def test_scrambler_tables_cached(tmp_path):
+    scrambler, next_state = scrambler_tables('123', 'B')
+    scrambler_tables('123', 'B', cache_directory=str(tmp_path))
+    cached_scrambler, cached_next_state = scrambler_tables(
+        '123', 'B', cache_directory=str(tmp_path))
+    assert list(cached_next_state) == next_state
+    assert [list(row) for row in cached_scrambler] == scrambler